@@ -0,0 +1,205 @@
+"""命令行批量转换，不依赖 PyQt6
+
+用法示例：
+    python -m batch input/ -o output --font 义启手写体.ttf --background 背景1.jpg --profile Parameter/背景1.json -j 4
+    python -m batch input/ -o output --font 义启手写体.ttf --variants 背景1.jpg 背景2.jpg 背景3.jpg
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from page_writer import OUTPUT_FORMATS
+from pipeline import DocumentConverter, VariantConverter
+from profiles import ProfileError, compile_layout, list_users, load_profile, variant_params
+from render import background_cache
+from reader import collect_inputs
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def resolve_asset(path, folder):
+    """资源可以是路径，也可以是 fonts/ 或 Background/ 下的文件名"""
+    if os.path.exists(path):
+        return os.path.abspath(path)
+    candidate = os.path.join(BASE_DIR, folder, path)
+    if os.path.exists(candidate):
+        return candidate
+    raise FileNotFoundError(f"找不到文件: {path}")
+
+
+def load_params(args):
+    """读取参数配置并补上字体、背景等运行参数
+
+    没有指定 --profile 时按背景选择配置：default.json 之上叠加 Parameter/<背景名>.json；
+    --user 的用户配置再叠加在最上面
+    """
+    background_path = resolve_asset(args.background, 'Background') if args.background is not None else None
+    if args.profile:
+        params = load_profile(user=args.user, base=args.profile)
+    else:
+        params = load_profile(background_path, args.user)
+    params['font_path'] = resolve_asset(args.font, 'fonts')
+    if background_path is not None:
+        params['background_path'] = background_path
+    return apply_overrides(params, args)
+
+
+def load_variants(args, params):
+    """--variants 的每个背景一份参数：叠加该背景的参数配置和用户配置，命令行指定的值优先"""
+    backgrounds = [resolve_asset(path, 'Background') for path in args.variants]
+    return [apply_overrides(variant, args) for variant in variant_params(params, backgrounds, args.user)]
+
+
+def apply_overrides(params, args):
+    """命令行中指定的运行参数覆盖参数配置"""
+    if args.seed is not None:
+        params['seed'] = args.seed
+    if args.format is not None:
+        params['output_format'] = args.format
+    if args.quality is not None:
+        params['quality'] = args.quality
+    if args.png_compress_level is not None:
+        params['png_compress_level'] = args.png_compress_level
+    if args.band_height is not None:
+        params['band_height'] = args.band_height
+    if args.no_cache:
+        params['render_cache'] = False
+    if args.resume:
+        params['resume'] = True
+    if args.workers is not None:
+        params['workers'] = args.workers
+    return params
+
+
+def convert_one(input_file, output_dir, params, trace=(), collect_events=False, variants=None):
+    """转换单个文件，返回该文件的统计信息（供进程池调用）
+
+    collect_events 时把转换过程中的结构化事件放在 'events' 中一并返回；
+    给出 variants 时在每个背景上各转换一份（此时不支持 trace）
+    """
+    start = time.perf_counter()
+    job = {'input': input_file}
+    events = [] if collect_events else None
+    try:
+        if variants:
+            converter = VariantConverter(input_file, output_dir, variants,
+                                         events=events.append if collect_events else None)
+        else:
+            converter = DocumentConverter(input_file, output_dir, params,
+                                          events=events.append if collect_events else None, profile=trace)
+        job.update(converter.run())
+    except Exception as e:
+        job['error'] = str(e)
+    job['seconds'] = round(time.perf_counter() - start, 3)
+    if collect_events:
+        job['events'] = events
+    return job
+
+
+def run_batch(files, output_dir, params, jobs, trace=(), collect_events=False, variants=None):
+    """按文档并行转换；只有一个并发时在文档内部按页并行"""
+    start = time.perf_counter()
+    if jobs <= 1 or len(files) <= 1:
+        results = [convert_one(input_file, output_dir, params, trace, collect_events, variants)
+                   for input_file in files]
+    else:
+        # 文档级并行时每个文档单进程渲染，避免进程池嵌套
+        doc_params = dict(params, workers=1)
+        doc_variants = [dict(variant, workers=1) for variant in variants] if variants else None
+        count = len(files)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(convert_one, files, [output_dir] * count, [doc_params] * count,
+                                        [trace] * count, [collect_events] * count, [doc_variants] * count))
+    seconds = time.perf_counter() - start
+
+    pages = sum(job.get('pages', 0) for job in results)
+    characters = sum(job.get('characters', 0) for job in results)
+    return {
+        'documents': len(results),
+        'failed': sum(1 for job in results if 'error' in job),
+        'pages': pages,
+        'characters': characters,
+        'seconds': round(seconds, 3),
+        'pages_per_sec': round(pages / seconds, 3) if seconds else 0,
+        'chars_per_sec': round(characters / seconds, 1) if seconds else 0,
+        'jobs': results,
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m batch', description='批量把文本转换为手写图像')
+    parser.add_argument('inputs', nargs='+', help='输入文件或目录（.txt/.doc/.docx）')
+    parser.add_argument('-o', '--output', default='output', help='输出目录')
+    parser.add_argument('--font', required=True, help='字体文件路径或 fonts/ 下的文件名')
+    parser.add_argument('--background', default=None, help='背景图片路径或 Background/ 下的文件名')
+    parser.add_argument('--variants', nargs='+', default=None,
+                        help='在这些背景上各转换一份，输出到以背景命名的子目录；'
+                             '每个背景叠加同名的参数配置 Parameter/<背景名>.json，排版相同的背景只排版一次')
+    parser.add_argument('--profile', default=None,
+                        help='参数配置文件；默认为 default.json 叠加背景同名的 Parameter/<背景名>.json')
+    parser.add_argument('--user', default=None,
+                        help=f"叠加用户配置 Parameter/Users/<用户>.json（{'、'.join(list_users()) or '无'}）")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='同时转换的文档数')
+    parser.add_argument('--workers', type=int, default=None, help='单个文档渲染使用的进程数')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子，便于复现')
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default=None,
+                        help='输出格式；pdf/tiff 把所有页写进一个文件')
+    parser.add_argument('--quality', type=int, default=None, help='jpeg/webp 质量 (1-100)')
+    parser.add_argument('--png-compress-level', type=int, default=None, help='png 压缩级别 (0-9)，越小越快')
+    parser.add_argument('--band-height', type=int, default=None,
+                        help='png 分条渲染的条高（像素行），0 为整页渲染；默认只在背景很大时分条')
+    parser.add_argument('--no-cache', action='store_true', help='忽略输出目录中的清单，重新渲染所有页')
+    parser.add_argument('--resume', action='store_true',
+                        help='从上次中断的断点继续（参数和输入都没有变化时），之前的页不再排版和渲染')
+    parser.add_argument('--events', default=None,
+                        help='把每页的阶段耗时等结构化事件写入该文件（JSON Lines）')
+    parser.add_argument('--trace', action='append', choices=('cpu', 'memory'), default=[],
+                        help='用 cProfile (cpu) 或 tracemalloc (memory) 分析转换过程，可重复指定')
+    parser.add_argument('-r', '--recursive', action='store_true', help='递归查找目录中的文件')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.background is None and not args.variants:
+        parser.error("需要 --background 或 --variants")
+    try:
+        params = load_params(args)
+        variants = load_variants(args, params) if args.variants else None
+        # 按背景尺寸检查边距等排版参数
+        for variant in variants or [params]:
+            compile_layout(variant, background_cache.page_size(variant['background_path']))
+    except ProfileError as e:
+        print(f"参数配置有误: {e}", file=sys.stderr)
+        return 2
+    except FileNotFoundError as e:
+        # 字体或背景的路径写错
+        print(e, file=sys.stderr)
+        return 2
+
+    files = collect_inputs(args.inputs, args.recursive)
+    if not files:
+        print("没有找到可转换的文件", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output, exist_ok=True)
+    summary = run_batch(files, args.output, params, args.jobs, tuple(args.trace), args.events is not None,
+                        variants)
+    if args.events is not None:
+        with open(args.events, 'w', encoding='utf-8') as f:
+            for job in summary['jobs']:
+                for event in job.pop('events'):
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+    for job in summary['jobs']:
+        # 分析报告较长，输出到标准错误（也在事件文件中）
+        for kind, report in job.pop('profile', {}).items():
+            print(f"== {job['input']} {kind} ==\n{report}", file=sys.stderr)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
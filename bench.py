@@ -0,0 +1,242 @@
+"""渲染流程的性能基准，不依赖 PyQt6
+
+用固定的合成文本（中文、英文、混排；短篇和长篇）分别配合 fonts/ 中的每个字体和
+Background/ 中的每个背景进行转换，统计每秒页数、每秒字数、峰值内存和各阶段耗时，
+结果写入 JSON，便于比较不同版本。
+
+用法示例：
+    python -m bench -o bench.json
+    python -m bench --sizes short,book --baseline old.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import PIL
+from layout import iter_pages
+from page_writer import OUTPUT_FORMATS, output_format, save_options
+from pipeline import DocumentConverter
+from profiles import load_profile
+from reader import ParagraphReader
+from render import background_cache, page_glyphs, render_page
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 合成文本的大致字数
+CORPUS_SIZES = {'short': 2000, 'book': 100000}
+CORPUS_KINDS = ('cjk', 'latin', 'mixed')
+LATIN_WORDS = ('the quick brown fox jumps over lazy dog handwriting simulator renders every '
+               'character with a small random offset so that pages look written by hand').split()
+# 各阶段：读取、排版、绘制、编码、写盘
+STAGES = ('read', 'layout', 'draw', 'encode', 'write')
+
+
+def common_cjk_chars():
+    """GB2312 一级汉字（3755 个常用字）"""
+    return [bytes([high, low]).decode('gb2312')
+            for high in range(0xB0, 0xD8) for low in range(0xA1, 0xFF)
+            if not (high == 0xD7 and low > 0xF9)]
+
+
+def make_corpus(kind, size, seed=0):
+    """生成固定的合成文本，同样的参数每次结果相同"""
+    rng = random.Random(f"{kind}-{size}-{seed}")
+    hanzi = common_cjk_chars()
+    paragraphs = []
+    count = 0
+    while count < size:
+        parts = []
+        for _ in range(rng.randint(3, 8)):
+            use_cjk = kind == 'cjk' or (kind == 'mixed' and rng.random() < 0.6)
+            if use_cjk:
+                parts.append(''.join(rng.choice(hanzi) for _ in range(rng.randint(8, 20))) + '。')
+            else:
+                words = [rng.choice(LATIN_WORDS) for _ in range(rng.randint(5, 12))]
+                parts.append(' '.join(words).capitalize() + '. ')
+        paragraph = ''.join(parts)
+        paragraphs.append(paragraph)
+        count += len(paragraph)
+    return '\n'.join(paragraphs)
+
+
+def list_assets(folder, exts):
+    path = os.path.join(BASE_DIR, folder)
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(exts)]
+
+
+def peak_rss_mb():
+    """本进程和子进程的峰值内存 (MB)；不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+            round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1))
+
+
+def run_case(case):
+    """运行一个用例（在独立进程中调用，缓存和内存统计互不影响）"""
+    params = dict(case['params'])
+    work_dir = tempfile.mkdtemp(prefix='bench_')
+
+    # 端到端：与实际转换相同的流程（流式读取、并行渲染、后台写盘）
+    start = time.perf_counter()
+    result = DocumentConverter(case['input'], work_dir, params).run()
+    seconds = time.perf_counter() - start
+    # 峰值内存在分阶段计时之前读取：之后的分阶段会在本进程中再渲染一遍整个文档
+    peak, children_peak = peak_rss_mb()
+
+    # 分阶段：按顺序执行各阶段，分别计时；绘制前先预热本进程的字形和背景缓存
+    stages = dict.fromkeys(STAGES, 0.0)
+    clock = time.perf_counter()
+
+    def lap(stage):
+        nonlocal clock
+        now = time.perf_counter()
+        stages[stage] += now - clock
+        clock = now
+
+    paragraphs = list(ParagraphReader(case['input']))
+    lap('read')
+    pages = list(iter_pages(paragraphs, params, background_cache.page_size(params['background_path'])))
+    lap('layout')
+    # 多进程时端到端的渲染在子进程中进行，本进程的缓存仍是冷的；预热不计入各阶段
+    background_cache.get(params['background_path'])
+    for page in pages:
+        page_glyphs(page, params)
+    clock = time.perf_counter()
+    fmt = output_format(params)
+    options = save_options(params)
+    for page in pages:
+        image = render_page(page, params)
+        lap('draw')
+        buffer = io.BytesIO()
+        image.save(buffer, OUTPUT_FORMATS[fmt][0], **options)
+        lap('encode')
+        with open(os.path.join(work_dir, f"stage_{page.number:03d}{OUTPUT_FORMATS[fmt][1]}"), 'wb') as f:
+            f.write(buffer.getbuffer())
+        lap('write')
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'corpus': case['corpus'],
+        'font': os.path.basename(params['font_path']),
+        'background': os.path.basename(params['background_path']),
+        'pages': result['pages'],
+        'characters': result['characters'],
+        'seconds': round(seconds, 3),
+        'pages_per_sec': round(result['pages'] / seconds, 3) if seconds else 0,
+        'chars_per_sec': round(result['characters'] / seconds, 1) if seconds else 0,
+        'peak_rss_mb': peak,
+        'children_peak_rss_mb': children_peak,
+        'stages': {stage: round(value, 3) for stage, value in stages.items()},
+    }
+
+
+def run_isolated(cases):
+    """每个用例一个新进程，冷启动缓存，峰值内存只属于该用例；依次产出结果
+
+    Python 3.11 起进程池可以每个任务换一个进程，更早的版本每个用例单独启动一个进程池
+    """
+    if sys.version_info >= (3, 11):
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+            yield from executor.map(run_case, cases)
+        return
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            yield executor.submit(run_case, case).result()
+
+
+def case_id(result):
+    return f"{result['corpus']}/{result['font']}/{result['background']}"
+
+
+def compare(results, baseline_path):
+    """与旧结果比较每秒页数，返回 {用例: 变化比例}"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {case_id(result): result for result in json.load(f)['cases']}
+    changes = {}
+    for result in results:
+        old = baseline.get(case_id(result))
+        if old and old['pages_per_sec']:
+            changes[case_id(result)] = round(result['pages_per_sec'] / old['pages_per_sec'] - 1, 3)
+    return changes
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m bench', description='渲染流程性能基准')
+    parser.add_argument('-o', '--output', default='bench.json', help='结果 JSON 文件')
+    parser.add_argument('--sizes', default='short', help=f"文本长度，逗号分隔：{','.join(CORPUS_SIZES)}")
+    parser.add_argument('--corpora', default=','.join(CORPUS_KINDS), help='文本类型，逗号分隔')
+    parser.add_argument('--fonts', nargs='*', default=None, help='只测这些字体（fonts/ 下的文件名）')
+    parser.add_argument('--backgrounds', nargs='*', default=None, help='只测这些背景（Background/ 下的文件名）')
+    parser.add_argument('--workers', type=int, default=None, help='单个文档渲染使用的进程数')
+    parser.add_argument('--format', choices=sorted(OUTPUT_FORMATS), default='png', help='输出格式')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--baseline', default=None, help='与之前的结果 JSON 比较')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    fonts = [path for path in list_assets('fonts', ('.ttf', '.otf'))
+             if not args.fonts or os.path.basename(path) in args.fonts]
+    backgrounds = [path for path in list_assets('Background', ('.png', '.jpg', '.jpeg'))
+                   if not args.backgrounds or os.path.basename(path) in args.backgrounds]
+
+    corpus_dir = tempfile.mkdtemp(prefix='bench_corpus_')
+    cases = []
+    for size in args.sizes.split(','):
+        for kind in args.corpora.split(','):
+            input_file = os.path.join(corpus_dir, f"{kind}_{size}.txt")
+            with open(input_file, 'w', encoding='utf-8') as f:
+                f.write(make_corpus(kind, CORPUS_SIZES[size]))
+            for font_path in fonts:
+                for background_path in backgrounds:
+                    params = dict(load_profile(background_path), font_path=font_path,
+                                  background_path=background_path, seed=args.seed,
+                                  output_format=args.format, render_cache=False)
+                    if args.workers is not None:
+                        params['workers'] = args.workers
+                    cases.append({'corpus': f"{kind}_{size}", 'input': input_file, 'params': params})
+
+    # 每个用例一个新进程，冷启动缓存，峰值内存只属于该用例
+    results = []
+    for result in run_isolated(cases):
+        results.append(result)
+        print(f"{case_id(result)}: {result['pages_per_sec']} 页/秒, "
+              f"{result['chars_per_sec']} 字/秒, {result['peak_rss_mb']} MB", file=sys.stderr)
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'cases': results,
+    }
+    if args.baseline:
+        report['change_vs_baseline'] = compare(results, args.baseline)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        print(json.dumps(report['change_vs_baseline'], ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
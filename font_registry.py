@@ -0,0 +1,122 @@
+from collections import namedtuple
+import os
+import threading
+import unicodedata
+from PIL import ImageFont
+
+# 字体元数据：名称、字形数、每 em 单位数、PROBE_SIZE 字号下的上下伸（像素）、cmap 覆盖的码位
+FontInfo = namedtuple('FontInfo', ['path', 'family', 'style', 'glyph_count', 'units_per_em',
+                                   'ascent', 'descent', 'codepoints'])
+
+# 读取度量和没有 fontTools 时判断缺字的字号
+PROBE_SIZE = 32
+
+
+class FontRegistry:
+    """进程内的字体登记表：字体对象按 (路径, 字号) 只加载一次，并记录每个字体的覆盖范围"""
+    def __init__(self):
+        self._fonts = {}
+        self._infos = {}
+        self._probes = {}
+        self._lock = threading.RLock()
+
+    def get_font(self, font_path, font_size):
+        """获取字体对象，同一字体和字号只加载一次"""
+        with self._lock:
+            key = (font_path, font_size)
+            font = self._fonts.get(key)
+            if font is None:
+                font = ImageFont.truetype(font_path, font_size)
+                self._fonts[key] = font
+            return font
+
+    def info(self, font_path):
+        """字体元数据，文件变化后重新读取"""
+        with self._lock:
+            key = (font_path, os.path.getmtime(font_path))
+            info = self._infos.get(key)
+            if info is None:
+                info = self._load_info(font_path)
+                self._infos[key] = info
+            return info
+
+    def preload(self, font_paths):
+        """在后台线程读取字体元数据，启动时调用，不阻塞界面"""
+        def load():
+            for font_path in font_paths:
+                try:
+                    self.info(font_path)
+                except Exception:
+                    # 损坏的字体在真正使用时再报错
+                    pass
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+
+    def covers(self, font_path, char):
+        """字体是否包含该字符的字形"""
+        codepoints = self.info(font_path).codepoints
+        if codepoints is not None:
+            return ord(char) in codepoints
+        return self._probe(font_path, char)
+
+    def missing_chars(self, font_path, chars):
+        """chars 中字体没有字形的字符（忽略空白和控制字符），返回集合"""
+        missing = set()
+        for char in set(chars):
+            if char.isspace() or unicodedata.category(char) == 'Cc':
+                continue
+            if not self.covers(font_path, char):
+                missing.add(char)
+        return missing
+
+    def clear(self):
+        """清空登记表"""
+        with self._lock:
+            self._fonts.clear()
+            self._infos.clear()
+            self._probes.clear()
+
+    def _load_info(self, font_path):
+        font = self.get_font(font_path, PROBE_SIZE)
+        family, style = font.getname()
+        # 度量由 Pillow 读取，有没有 fontTools 都一样
+        ascent, descent = font.getmetrics()
+        try:
+            # fontTools 为可选依赖，只用于直接读取 cmap
+            from fontTools.ttLib import TTFont
+        except ImportError:
+            return FontInfo(font_path, family, style, None, None, ascent, descent, None)
+        with TTFont(font_path, lazy=True) as ttfont:
+            return FontInfo(
+                font_path, family, style,
+                glyph_count=ttfont['maxp'].numGlyphs,
+                units_per_em=ttfont['head'].unitsPerEm,
+                ascent=ascent,
+                descent=descent,
+                codepoints=frozenset(ttfont.getBestCmap()),
+            )
+
+    def _probe(self, font_path, char):
+        # 没有 cmap 信息时，与 .notdef（方框）的渲染结果比较
+        with self._lock:
+            key = (font_path, char)
+            covered = self._probes.get(key)
+            if covered is None:
+                font = self.get_font(font_path, PROBE_SIZE)
+                notdef = self._probes.get((font_path, None))
+                if notdef is None:
+                    notdef = self._mask_of(font, '\U0010fffd')
+                    self._probes[(font_path, None)] = notdef
+                covered = self._mask_of(font, char) != notdef
+                self._probes[key] = covered
+            return covered
+
+    @staticmethod
+    def _mask_of(font, char):
+        mask = font.getmask(char)
+        return mask.size, bytes(mask)
+
+
+# 进程内共享的字体登记表
+font_registry = FontRegistry()
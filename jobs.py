@@ -0,0 +1,173 @@
+import itertools
+import os
+import threading
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class Job:
+    """一个文档的转换任务；variants 为多背景转换时每个背景的参数"""
+    def __init__(self, job_id, input_file, output_dir, params, variants=None):
+        self.id = job_id
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.params = params
+        self.variants = variants
+        self.status = QUEUED
+        self.progress = 0
+        self.message = "等待中"
+        self.result = None
+        self.converter = None
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+class JobQueue:
+    """文档转换队列：最多同时转换 max_jobs 个文档，其余按队列顺序等待
+
+    任务在后台线程中运行，状态变化时以任务为参数调用 listener（在后台线程中调用）
+    """
+    def __init__(self, max_jobs=2, listener=None):
+        self.max_jobs = max_jobs
+        self.listener = listener or (lambda job: None)
+        self.jobs = {}
+        self._pending = []  # 等待中的任务，排在前面的先转换
+        self._running = 0
+        self._threads = []
+        self._closed = False
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+
+    def add(self, input_file, output_dir, params, variants=None):
+        """加入一个任务，返回 Job；给出 variants 时在每个背景上各转换一份"""
+        with self._condition:
+            job = Job(next(self._ids), input_file, output_dir, params, variants)
+            self.jobs[job.id] = job
+            self._pending.append(job)
+            self._start_threads()
+            self._condition.notify_all()
+        self.listener(job)
+        return job
+
+    def set_max_jobs(self, max_jobs):
+        """修改同时转换的文档数，正在转换的任务不受影响"""
+        with self._condition:
+            self.max_jobs = max(1, max_jobs)
+            self._start_threads()
+            self._condition.notify_all()
+
+    def cancel(self, job_id):
+        """取消任务：等待中的直接移出队列，正在转换的请求停止"""
+        with self._condition:
+            job = self.jobs[job_id]
+            if job in self._pending:
+                self._pending.remove(job)
+                job.status = CANCELLED
+                job.message = "已取消"
+            elif job.status == RUNNING:
+                job.converter.stop()
+                job.message = "正在取消..."
+            else:
+                return
+        self.listener(job)
+
+    def reorder(self, job_ids):
+        """按 job_ids 的顺序调整等待中任务的优先级，未列出的任务排在最后"""
+        with self._condition:
+            order = {job_id: index for index, job_id in enumerate(job_ids)}
+            self._pending.sort(key=lambda job: order.get(job.id, len(order)))
+
+    def progress(self):
+        """所有未取消任务的总体进度 (0~100)"""
+        with self._condition:
+            jobs = [job for job in self.jobs.values() if job.status != CANCELLED]
+        if not jobs:
+            return 0
+        return int(sum(100 if job.finished else job.progress for job in jobs) / len(jobs))
+
+    def is_idle(self):
+        """没有等待中或正在转换的任务"""
+        with self._condition:
+            return not self._pending and not self._running
+
+    def close(self, wait=True):
+        """停止所有任务并结束后台线程"""
+        with self._condition:
+            self._closed = True
+            for job in self._pending:
+                job.status = CANCELLED
+                job.message = "已取消"
+            self._pending.clear()
+            for job in self.jobs.values():
+                if job.status == RUNNING:
+                    job.converter.stop()
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _start_threads(self):
+        # 线程只增不减，并发数由 _running 控制
+        while len(self._threads) < self.max_jobs:
+            thread = threading.Thread(target=self._work, daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_job(self):
+        with self._condition:
+            while not self._closed and (not self._pending or self._running >= self.max_jobs):
+                self._condition.wait()
+            if self._closed:
+                return None
+            job = self._pending.pop(0)
+            # 转换流程（numpy、Pillow 等）到第一个任务开始时才导入，界面启动更快
+            from pipeline import DocumentConverter, VariantConverter
+            # 多个文档同时转换时分摊 CPU，避免进程数成倍增加
+            workers = max(1, (os.cpu_count() or 1) // self.max_jobs)
+            progress = lambda value, message: self._progress(job, value, message)
+            if job.variants:
+                variants = [dict(params, workers=params.get('workers') or workers) for params in job.variants]
+                job.converter = VariantConverter(job.input_file, job.output_dir, variants, progress=progress)
+            else:
+                params = dict(job.params, workers=job.params.get('workers') or workers)
+                job.converter = DocumentConverter(job.input_file, job.output_dir, params, progress=progress)
+            job.status = RUNNING
+            job.message = "正在转换..."
+            self._running += 1
+            return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self.listener(job)
+            try:
+                job.result = job.converter.run()
+                job.status = DONE
+                job.message = f"完成，共 {job.result['pages']} 页"
+                missing = job.result['missing_chars']
+                if missing:
+                    job.message += f"，缺少 {len(missing)} 个字形: {missing[:20]}{'…' if len(missing) > 20 else ''}"
+            except InterruptedError:
+                job.status = CANCELLED
+                job.message = "已取消"
+            except Exception as e:
+                job.status = FAILED
+                job.message = f"错误: {str(e)}"
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+            self.listener(job)
+
+    def _progress(self, job, value, message):
+        job.progress = value
+        job.message = message
+        self.listener(job)
@@ -0,0 +1,320 @@
+from collections import OrderedDict, namedtuple
+import hashlib
+import math
+import threading
+import unicodedata
+import numpy as np
+from profiles import compile_layout
+from render import glyph_cache
+
+# 避头：不能出现在行首的标点
+NO_BREAK_BEFORE = set('，。、；：？！）］｝】》〉」』”’…—～·‥〕〗〙〛ー々ぁぃぅぇぉっゃゅょゎァィゥェォッャュョヮヵヶ'
+                      ',.;:?!)]}%')
+# 避尾：不能出现在行尾的标点
+NO_BREAK_AFTER = set('（［｛【《〈「『“‘〔〖〘〚([{')
+
+
+def is_wide(char):
+    """全角字符（中日韩文字等）之间可以断行"""
+    return unicodedata.east_asian_width(char) in ('W', 'F')
+
+
+def split_segments(text):
+    """把段落切成不可再分的片段：西文单词、单个全角字符、空白，标点按避头尾规则并入相邻片段
+
+    依次产出 (类型, 文本)，超长段落也不必先把所有片段切好
+    """
+    last_kind = last_text = None
+    for char in text:
+        if char.isspace():
+            kind = 'space'
+        elif is_wide(char):
+            kind = 'wide'
+        else:
+            kind = 'word'
+
+        if last_text is not None:
+            if kind != 'space' and last_kind != 'space' and char in NO_BREAK_BEFORE:
+                # 避头标点跟随前一个片段，片段类型不变
+                last_text += char
+                continue
+            if (kind == last_kind and kind != 'wide') or (kind != 'space' and last_text[-1] in NO_BREAK_AFTER):
+                last_kind, last_text = kind, last_text + char
+                continue
+            yield last_kind, last_text
+        last_kind, last_text = kind, char
+    if last_text is not None:
+        yield last_kind, last_text
+
+
+def line_spans(text, widths, max_width, spacing=0, slack=0, jitter=0):
+    """按实际字宽断行，依次产出各行在 text 中的范围 (起点, 终点)
+
+    widths[i] 为 text[i] 的前进宽度（字号抖动时各字不同）；spacing 为每个字后的字间距；
+    slack 为行尾预留的固定余量，jitter 为字间距扰动的标准差，
+    行内 n 个字的累计扰动按 jitter * sqrt(n - 1) 预留。
+    行尾的空白不计入范围，换行处的空白被丢弃，段首缩进保留。
+    """
+    def width_of(begin, end):
+        return sum(widths[index] + spacing for index in range(begin, end))
+
+    def fits(width, count):
+        # 最后一个字后面的字间距不占行宽
+        return width - spacing + slack + jitter * math.sqrt(max(count - 1, 0)) <= max_width
+
+    has_lines = False
+    start = None  # 当前行的起点，None 表示还没有内容
+    end = 0  # 当前行最后一个非空白字符之后的位置
+    width = 0.0
+    position = 0
+    for kind, segment in split_segments(text):
+        begin, position = position, position + len(segment)
+        segment_width = width_of(begin, position)
+        if kind == 'space':
+            # 保留段首缩进，丢弃换行处的空白
+            if start is not None or not has_lines:
+                if start is None:
+                    start = end = begin
+                width += segment_width
+            continue
+
+        if fits(width + segment_width, position - (begin if start is None else start)):
+            if start is None:
+                start = begin
+            width += segment_width
+            end = position
+            continue
+
+        if start is not None and end > start:
+            yield start, end
+            start, width, has_lines = None, 0.0, True
+        if fits(width + segment_width, position - (begin if start is None else start)):
+            if start is None:
+                start = begin
+            width += segment_width
+            end = position
+            continue
+
+        # 单个片段比一行还长，只能逐字断开
+        for index in range(begin, position):
+            char_width = widths[index] + spacing
+            if start is not None and end > start and not fits(width + char_width, index - start + 1):
+                yield start, end
+                start, width, has_lines = None, 0.0, True
+            if start is None:
+                start = index
+            width += char_width
+            end = index + 1
+
+    if start is not None and end > start:
+        yield start, end
+
+
+def break_lines(text, measure, max_width, spacing=0, slack=0, jitter=0):
+    """按实际字宽断行，返回各行文本；measure(char) 返回字符的前进宽度，其余参数见 line_spans"""
+    text = text.expandtabs(4)
+    widths = [measure(char) for char in text]
+    return [text[start:end] for start, end in line_spans(text, widths, max_width, spacing, slack, jitter)]
+
+
+# 排版结果中的一页：页码、行列表、文档随机种子（与页码一起决定该页的扰动）
+PageLayout = namedtuple('PageLayout', ['number', 'lines', 'seed'])
+# 一行：顶部 y 坐标、文本、各字的排版位置 [(字符, x), ...]、各字的字号（不抖动时为 None）
+Line = namedtuple('Line', ['y', 'text', 'glyphs', 'sizes'], defaults=(None,))
+
+# 排版到某页开头时的位置，用于从断点继续：页码、该页第一行所在的段落序号和段内行号、
+# 字号抖动随机流在该段之前的状态（不抖动时为 None）
+LayoutPosition = namedtuple('LayoutPosition', ['page', 'paragraph', 'line', 'sizes_state'])
+
+# 测量字宽时每隔这么多字检查一次是否取消
+MEASURE_CHUNK = 16384
+
+# 影响排版结果的参数
+LAYOUT_PARAMS = (
+    'font_path', 'font_size', 'font_size_sigma', 'font_size_buckets', 'word_spacing', 'word_spacing_sigma',
+    'line_spacing', 'left_margin', 'right_margin', 'top_margin', 'bottom_margin', 'perturb_x_sigma', 'seed',
+)
+
+
+def document_seed(params):
+    """文档随机种子；参数中没有 seed 时随机生成"""
+    seed = params.get('seed')
+    if seed is not None:
+        return int(seed)
+    return int(np.random.SeedSequence().entropy)
+
+
+def size_stream(geometry, seed):
+    """字号抖动的随机流，由文档种子决定，按字的顺序依次取用；不抖动时为 None"""
+    if not geometry.size_buckets:
+        return None
+    return np.random.default_rng([seed, 0, 2])
+
+
+def sample_sizes(rng, geometry, count):
+    """从随机流中依次取 count 个字的字号
+
+    字号按 font_size_sigma 正态抖动后量化到最接近的档位，只有少数几个字号，
+    每个字号的字体和字形只加载一次
+    """
+    buckets = np.array(geometry.size_buckets)
+    bounds = (buckets[1:] + buckets[:-1]) / 2
+    sizes = geometry.font_size + rng.standard_normal(count) * geometry.size_sigma
+    return buckets[np.searchsorted(bounds, sizes)].tolist()
+
+
+def iter_pages(paragraphs, params, page_size, is_running=None, start=None, mark=None):
+    """排版：断行、分页并给出每个字的位置，每排满一页就产出一个 PageLayout
+
+    paragraphs 可以是任意可迭代对象（如逐段读取的文件），不需要事先读完；
+    参数先编译为 PageGeometry，无效的参数在排版开始前抛出 ProfileError。
+    mark(LayoutPosition) 在产出每页之前调用，给出下一页从哪里开始；
+    start 为这样的 LayoutPosition 时从该处继续排版，paragraphs 仍从头给出，之前的段落只跳过不排版。
+    is_running 每段、每行都会检查，超长段落也能及时取消
+    """
+    geometry = compile_layout(params, page_size)
+    font_path = geometry.font_path
+    font_size = geometry.font_size
+    word_spacing = geometry.word_spacing
+    line_spacing = geometry.line_spacing
+    left_margin = geometry.left_margin
+    top_margin = geometry.top_margin
+    bottom_limit = geometry.bottom_limit
+    seed = document_seed(params)
+    rng = size_stream(geometry, seed)
+    advance = glyph_cache.advance
+    check = is_running or (lambda: True)
+
+    number = 1
+    lines = []
+    current_y = top_margin
+    if start is not None:
+        number = start.page
+        if rng is not None:
+            rng.bit_generator.state = start.sizes_state
+
+    for i, paragraph in enumerate(paragraphs):
+        if not check():
+            raise InterruptedError("转换已取消")
+        skip = 0
+        if start is not None and i <= start.paragraph:
+            if i < start.paragraph:
+                continue
+            # 断点所在的段：跳过上一页已排的行，下一行就在页首
+            skip = start.line
+        elif i > 0:
+            # 段落间距（加在后一段之前，不需要预先知道段落总数）
+            current_y += geometry.paragraph_spacing
+
+        # 每个字的前进宽度只取一次，断行和定位共用；字号抖动时按各字的字号测量
+        text = paragraph.expandtabs(4)
+        state = rng.bit_generator.state if rng is not None and mark is not None else None
+        sizes = sample_sizes(rng, geometry, len(text)) if rng is not None else None
+        widths = []
+        for begin in range(0, len(text), MEASURE_CHUNK):
+            if begin and not check():
+                raise InterruptedError("转换已取消")
+            chunk = text[begin:begin + MEASURE_CHUNK]
+            if sizes is None:
+                widths += [advance(font_path, font_size, char) for char in chunk]
+            else:
+                chunk_sizes = sizes[begin:begin + MEASURE_CHUNK]
+                widths += [advance(font_path, size, char) for char, size in zip(chunk, chunk_sizes)]
+
+        # 按实际字宽断行，行尾为扰动预留余量；逐行产出，边断行边排版
+        spans = line_spans(
+            text,
+            widths,
+            geometry.max_width,
+            spacing=word_spacing,
+            slack=geometry.slack,
+            jitter=geometry.jitter,
+        )
+
+        for line_index, (begin, end) in enumerate(spans):
+            if line_index < skip:
+                continue
+            if not check():
+                raise InterruptedError("转换已取消")
+            # 检查是否需要新页
+            if current_y + font_size > bottom_limit:
+                if mark is not None:
+                    mark(LayoutPosition(number + 1, i, line_index, state))
+                yield PageLayout(number, lines, seed)
+                number += 1
+                lines = []
+                current_y = top_margin
+
+            glyphs = []
+            x = left_margin
+            for index in range(begin, end):
+                glyphs.append((text[index], x))
+                x += widths[index] + word_spacing
+            lines.append(Line(current_y, text[begin:end], glyphs, sizes[begin:end] if sizes else None))
+            current_y += line_spacing
+
+    # 最后一页
+    yield PageLayout(number, lines, seed)
+
+
+def layout_document(paragraphs, params, page_size, is_running=None):
+    """排版整篇文档，返回 PageLayout 列表"""
+    return list(iter_pages(paragraphs, params, page_size, is_running))
+
+
+class LayoutCache:
+    """排版结果缓存，按 (文本哈希, 排版参数, 页面尺寸) 保存，预览和转换共用
+
+    排版时可以附带输入文件的身份 (source_key)，转换时据此直接找到预览排好的结果，
+    不必先把文件完整读入内存计算哈希
+    """
+    def __init__(self, max_items=4):
+        self.max_items = max_items
+        self._layouts = OrderedDict()
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def params_key(params, page_size):
+        return (tuple(params.get(name) for name in LAYOUT_PARAMS), tuple(page_size))
+
+    def key(self, text, params, page_size):
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return (digest,) + self.params_key(params, page_size)
+
+    def get(self, text, params, page_size, is_running=None, source=None):
+        """获取排版结果，未命中时排版并缓存"""
+        key = self.key(text, params, page_size)
+        with self._lock:
+            pages = self._layouts.get(key)
+            if pages is not None:
+                self._layouts.move_to_end(key)
+        if pages is None:
+            # 排版耗时较长，不持有锁
+            pages = layout_document(text.split('\n'), params, page_size, is_running)
+            with self._lock:
+                self._layouts[key] = pages
+                while len(self._layouts) > self.max_items:
+                    self._layouts.popitem(last=False)
+        if source is not None:
+            with self._lock:
+                self._sources[(source,) + self.params_key(params, page_size)] = key
+        return pages
+
+    def find(self, source, params, page_size):
+        """按输入文件身份查找已有的排版结果，没有时返回 None"""
+        with self._lock:
+            key = self._sources.get((source,) + self.params_key(params, page_size))
+            if key is None:
+                return None
+            return self._layouts.get(key)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._layouts.clear()
+            self._sources.clear()
+
+
+# 进程内共享的排版缓存
+layout_cache = LayoutCache()
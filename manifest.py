@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+from page_writer import is_multipage, output_format, save_options
+
+# 清单文件名，放在每个文档的输出目录中
+MANIFEST_NAME = '.manifest.json'
+# 断点记录文件名，与清单放在一起
+CHECKPOINT_NAME = '.checkpoint.json'
+# 只影响运行方式、不影响输出图像的参数
+RUN_ONLY_PARAMS = ('workers', 'max_pending_pages', 'render_cache', 'resume')
+
+
+def file_stamp(path):
+    """文件的身份：路径、修改时间和大小"""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_mtime, stat.st_size]
+
+
+def render_key(params):
+    """与具体页无关的渲染输入：字体、背景文件、渲染参数和输出编码
+
+    不含随机种子：种子记在每页的哈希中，沿用上次种子的转换与指定同一种子的转换得到相同的结果
+    """
+    settings = {key: value for key, value in params.items() if key not in RUN_ONLY_PARAMS and key != 'seed'}
+    data = {
+        'params': settings,
+        'font': file_stamp(params['font_path']),
+        'background': file_stamp(params['background_path']),
+        'format': output_format(params),
+        'options': save_options(params),
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class RenderManifest:
+    """记录每页输出对应的输入哈希，重新转换时跳过输入没有变化的页
+
+    哈希覆盖该页的排版结果（行、字和位置）、页码、随机种子以及 render_key。
+    """
+    def __init__(self, output_base, params):
+        self.path = os.path.join(output_base, MANIFEST_NAME)
+        self.render_key = render_key(params)
+        self.seed = None
+        self._old = {}
+        self._new = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.seed = data.get('seed')
+            self._old = data.get('pages', {})
+        except (OSError, ValueError):
+            # 没有清单或清单损坏时全部重新渲染
+            pass
+
+    def page_hash(self, page):
+        data = repr((self.render_key, page.number, page.seed, page.lines))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def is_current(self, page, path):
+        """输出文件存在且输入没有变化"""
+        entry = self._old.pop(str(page.number), None)
+        if (entry is not None and entry['file'] == os.path.basename(path)
+                and entry['hash'] == self.page_hash(page) and os.path.exists(path)):
+            self._new[str(page.number)] = entry
+            self.seed = page.seed
+            return True
+        return False
+
+    def record(self, page, path):
+        """记录一页已重新渲染"""
+        self.seed = page.seed
+        self._new[str(page.number)] = {'file': os.path.basename(path), 'hash': self.page_hash(page)}
+
+    def keep(self, last_page):
+        """从断点继续时前 last_page 页没有重新排版，沿用原来的记录"""
+        for number in [number for number in self._old if int(number) <= last_page]:
+            self._new[number] = self._old.pop(number)
+
+    def save(self, page_count=None):
+        """写入清单
+
+        转换完成时传入 page_count，删除多出来的旧页；转换中断时不传，
+        尚未处理到的页保留原来的记录
+        """
+        pages = dict(self._new)
+        for number, entry in self._old.items():
+            if page_count is None:
+                pages.setdefault(number, entry)
+            elif int(number) > page_count:
+                stale = os.path.join(os.path.dirname(self.path), entry['file'])
+                if os.path.exists(stale):
+                    os.remove(stale)
+        write_json(self.path, {'seed': self.seed, 'pages': pages})
+
+
+def write_json(path, data):
+    """先写临时文件再替换，中途崩溃也不会留下半个文件"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+
+
+class Checkpoint:
+    """断点记录：每连续写完一页，记下从哪里继续，中断或崩溃后可以从最后完成的页继续
+
+    记录的内容：最后完成的页码和累计字数、下一页在输入中的位置（段落序号、段内行号）、
+    字号抖动随机流的状态、随机种子，以及参数和输入文件的哈希（不一致时不能继续）。
+    只用于单页格式，多页格式的输出文件每次整体重写。
+    """
+    def __init__(self, output_base):
+        self.path = os.path.join(output_base, CHECKPOINT_NAME)
+        self.key = None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.record = json.load(f)
+        except (OSError, ValueError):
+            self.record = None
+
+    @property
+    def seed(self):
+        """上次转换使用的随机种子，没有记录时为 None"""
+        return self.record.get('seed') if self.record else None
+
+    def begin(self, params, source):
+        """开始转换：参数（含随机种子）已确定，source 为输入文件的身份"""
+        data = [render_key(params), params.get('seed'), source]
+        self.key = hashlib.sha1(json.dumps(data, default=str).encode('utf-8')).hexdigest()
+
+    def resume_point(self, page_path_of):
+        """可以继续的断点，没有时返回 None
+
+        参数或输入有变化、或者断点之前的页缺少输出文件时，不能继续；page_path_of(页码) 给出输出路径
+        """
+        record = self.record
+        if not record or record.get('key') != self.key:
+            return None
+        if not all(os.path.exists(page_path_of(number)) for number in range(1, record['page'] + 1)):
+            return None
+        return record
+
+    def save(self, page, characters, position, seed):
+        """记录前 page 页已全部写完；position 为下一页的开始位置 (layout.LayoutPosition)
+
+        使用预先排好的页时没有 position，继续时重新排版并跳过已完成的页
+        """
+        self.record = {
+            'key': self.key,
+            'page': page,
+            'characters': characters,
+            'offset': {'paragraph': position.paragraph, 'line': position.line} if position else None,
+            'sizes_state': position.sizes_state if position else None,
+            'seed': seed,
+        }
+        write_json(self.path, self.record)
+
+    def clear(self):
+        """转换完成，删除断点记录"""
+        self.record = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def stored_seed(output_base, params):
+    """输出目录中上次转换使用的随机种子：resume 时优先用断点中的，其次为输出清单中的；都没有时返回 None
+
+    参数中没有种子时，预览和转换都先用它排版，从断点继续或重新转换时没有修改的页保持原样
+    """
+    if is_multipage(params):
+        return None
+    seed = Checkpoint(output_base).seed if params.get('resume') else None
+    if seed is None and params.get('render_cache', True):
+        seed = RenderManifest(output_base, params).seed
+    return seed
@@ -0,0 +1,95 @@
+"""整页像素缓冲区：在渲染进程、编码器和 Qt 预览之间传递页面，不经过 pickle，也不反复复制整页
+
+像素按 RGB888 逐行存放，每行 stride 字节（按 4 字节对齐，QImage 可以直接使用）。
+放在共享内存中时，子进程按横条写入，传回主进程的只是共享内存的名字、尺寸和行宽；
+主进程在同一块内存上读取，用完后调用 release 释放。
+"""
+from multiprocessing import resource_tracker, shared_memory
+
+# numpy、Pillow 在用到时才导入：界面只用它显示预览
+
+
+def row_stride(width):
+    """RGB888 每行的字节数，按 4 字节对齐"""
+    return (width * 3 + 3) & ~3
+
+
+class PageBuffer:
+    """一页 RGB 像素；shared 时放在共享内存中，可以作为进程池任务的结果返回"""
+    def __init__(self, size, shared=False, name=None, stride=None):
+        self.size = tuple(size)
+        self.stride = stride or row_stride(self.size[0])
+        self._shm = None
+        if name is not None:
+            # 接收方：按名字打开子进程写好的共享内存
+            self._shm = shared_memory.SharedMemory(name=name)
+        elif shared:
+            self._shm = shared_memory.SharedMemory(create=True, size=self.stride * self.size[1])
+            # 由接收方释放：创建它的子进程退出时，本进程的 resource_tracker 不应再去删除它
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        # 共享内存的长度可能按页对齐，比 stride * 高度 大，多出的部分不使用
+        self.buf = self._shm.buf if self._shm is not None else memoryview(bytearray(self.stride * self.size[1]))
+
+    @classmethod
+    def from_image(cls, image, shared=False):
+        """复制一张 RGB 图像"""
+        buffer = cls(image.size, shared)
+        buffer.write(image)
+        return buffer
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def __reduce__(self):
+        # 传给其他进程时只传名字，像素留在共享内存中
+        if self._shm is None:
+            raise TypeError("只有共享内存中的页面可以传给其他进程")
+        return PageBuffer, (self.size, False, self._shm.name, self.stride)
+
+    def array(self):
+        """(高, 宽, 3) 的 numpy 视图，行宽为 stride，不复制；用完即丢，不要长期持有"""
+        import numpy as np
+
+        width, height = self.size
+        return np.ndarray((height, width, 3), dtype=np.uint8, buffer=self.buf, strides=(self.stride, 3, 1))
+
+    def write(self, image, top=0):
+        """把一张 RGB 图像（整页或一个横条）写到第 top 行开始的位置"""
+        import numpy as np
+
+        view = self.array()
+        view[top:top + image.height] = np.asarray(image)
+        del view
+
+    def to_image(self):
+        """解码为 Pillow 图像，供多页格式的编码器使用"""
+        from PIL import Image
+
+        return Image.frombuffer('RGB', self.size, self.buf, 'raw', 'RGB', self.stride, 1)
+
+    def release(self):
+        """释放像素；共享内存由接收方释放（同时删除），其他进程中的副本随之失效"""
+        self.buf.release()
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+def release_result(future):
+    """进程池 future 的完成回调：结果已无人取用时释放其中的共享内存页面
+
+    结果可以是 PageBuffer，也可以是 (PageBuffer, 统计) 这样的元组
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, PageBuffer):
+        result.release()
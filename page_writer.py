@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import struct
+import threading
+import time
+import zlib
+
+# numpy、Pillow 在用到时才导入：界面启动时只需要 OUTPUT_FORMATS 等常量
+
+# 输出格式 -> (Pillow 格式名, 扩展名)
+OUTPUT_FORMATS = {
+    'png': ('PNG', '.png'),
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+    'pdf': ('PDF', '.pdf'),
+    'tiff': ('TIFF', '.tif'),
+}
+# 所有页写入同一个文件的格式
+MULTIPAGE_FORMATS = ('pdf', 'tiff')
+
+
+def output_format(params):
+    """参数中的输出格式，默认 png"""
+    fmt = str(params.get('output_format', 'png')).lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {fmt}")
+    return fmt
+
+
+def is_multipage(params):
+    return output_format(params) in MULTIPAGE_FORMATS
+
+
+def page_path(output_base, number, params):
+    """第 number 页的输出路径；多页格式所有页共用一个文件"""
+    fmt = output_format(params)
+    ext = OUTPUT_FORMATS[fmt][1]
+    if fmt in MULTIPAGE_FORMATS:
+        return os.path.join(output_base, f"pages{ext}")
+    return os.path.join(output_base, f"page_{number:03d}{ext}")
+
+
+def save_options(params):
+    """各格式的编码参数"""
+    fmt = output_format(params)
+    if fmt == 'png':
+        return {'compress_level': int(params.get('png_compress_level', 6))}
+    if fmt in ('jpeg', 'webp'):
+        return {'quality': int(params.get('quality', 90))}
+    if fmt == 'tiff':
+        return {'compression': params.get('tiff_compression', 'tiff_deflate')}
+    return {}
+
+
+def encode_page(image, params):
+    """把一页编码为单页格式的字节（BytesIO）"""
+    buffer = io.BytesIO()
+    image.save(buffer, OUTPUT_FORMATS[output_format(params)][0], **save_options(params))
+    return buffer
+
+
+def encode_document(images, params):
+    """把所有页编码为一个多页文件（pdf/tiff）的字节"""
+    buffer = io.BytesIO()
+    images[0].save(buffer, OUTPUT_FORMATS[output_format(params)][0], save_all=True,
+                   append_images=images[1:], **save_options(params))
+    return buffer.getvalue()
+
+
+def save_page(image, path, params, append=False):
+    """编码并写入一页，返回 {'encode': 编码耗时, 'write': 写盘耗时, 'bytes': 写入的字节数}"""
+    fmt = output_format(params)
+    options = save_options(params)
+    start = time.perf_counter()
+    if fmt in MULTIPAGE_FORMATS:
+        # 多页格式逐页追加，不需要把整本文档留在内存里；编码和写盘交织，合计为编码耗时
+        size_before = os.path.getsize(path) if append else 0
+        if fmt == 'tiff':
+            from PIL import TiffImagePlugin
+            with TiffImagePlugin.AppendingTiffWriter(path, new=not append) as tiff:
+                image.save(tiff, 'TIFF', **options)
+        else:
+            image.save(path, OUTPUT_FORMATS[fmt][0], append=append, **options)
+        return {'encode': time.perf_counter() - start, 'write': 0.0,
+                'bytes': os.path.getsize(path) - size_before}
+
+    buffer = encode_page(image, params)
+    encoded = time.perf_counter()
+    with open(path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return {'encode': encoded - start, 'write': time.perf_counter() - encoded, 'bytes': buffer.tell()}
+
+
+def _png_chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)) + kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+
+def write_png_bands(path, size, bands, params):
+    """把依次产出的 RGB 横条直接压缩写成 PNG，不需要整页图像
+
+    每行使用 Up 滤波，跨条时接着上一条的最后一行；返回值与 save_page 相同
+    """
+    import numpy as np
+
+    width, height = size
+    compressor = zlib.compressobj(save_options(params)['compress_level'])
+    previous = np.zeros(width * 3, dtype=np.uint8)
+    encode = write = 0.0
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        for band in bands:
+            start = time.perf_counter()
+            rows = np.asarray(band).reshape(band.height, width * 3)
+            filtered = np.empty((band.height, width * 3 + 1), dtype=np.uint8)
+            filtered[:, 0] = 2  # Up 滤波：与上一行逐字节相减
+            np.subtract(rows[0], previous, out=filtered[0, 1:])
+            np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+            previous = rows[-1].copy()
+            data = compressor.compress(filtered)
+            encoded = time.perf_counter()
+            if data:
+                _png_chunk(f, b'IDAT', data)
+            write += time.perf_counter() - encoded
+            encode += encoded - start
+        start = time.perf_counter()
+        data = compressor.flush()
+        encoded = time.perf_counter()
+        _png_chunk(f, b'IDAT', data)
+        _png_chunk(f, b'IEND', b'')
+        encode += encoded - start
+        write += time.perf_counter() - encoded
+    return {'encode': encode, 'write': write, 'bytes': os.path.getsize(path)}
+
+
+class PageWriter:
+    """后台编码写盘：有界队列，渲染下一页时并行写出已完成的页
+
+    threads 为 0 时在调用线程中同步写盘；每页写完后以 (页码, save_page 的统计) 调用 on_written
+    """
+    def __init__(self, output_base, params, max_pending=2, threads=2, is_running=None, on_written=None):
+        self.output_base = output_base
+        self.params = params
+        self.is_running = is_running or (lambda: True)
+        self.on_written = on_written or (lambda number, stats: None)
+        self.multipage = is_multipage(params)
+        # 多页文件必须按顺序追加，只用一个线程
+        self._executor = None
+        if threads:
+            self._executor = ThreadPoolExecutor(max_workers=1 if self.multipage else threads)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+        self._pages_written = 0
+
+    def submit(self, number, image):
+        """提交一页；待写页数达到上限时阻塞（背压）"""
+        while not self._slots.acquire(timeout=0.2):
+            if not self.is_running():
+                raise InterruptedError("转换已取消")
+        if self._executor is None:
+            self._write(number, image)
+            return
+        try:
+            future = self._executor.submit(self._write, number, image)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._futures.append(future)
+        # 尽早暴露写盘错误
+        for done in [f for f in self._futures if f.done()]:
+            done.result()
+            self._futures.remove(done)
+
+    def _write(self, number, image):
+        try:
+            path = page_path(self.output_base, number, self.params)
+            append = self.multipage and self._pages_written > 0
+            stats = save_page(image, path, self.params, append=append)
+            self._pages_written += 1
+            self.on_written(number, stats)
+            return path
+        finally:
+            self._slots.release()
+
+    def close(self, cancel=False):
+        """等待所有页写完；cancel 时丢弃尚未开始的页，不等待正在写的页"""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=not cancel, cancel_futures=cancel)
+        if not cancel:
+            for future in self._futures:
+                future.result()
+        self._futures = []
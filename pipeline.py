@@ -0,0 +1,488 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import io
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from font_registry import font_registry
+from page_writer import PageWriter, is_multipage, page_path
+from layout import LayoutPosition, document_seed, iter_pages, layout_cache, layout_document
+from manifest import Checkpoint, RenderManifest, stored_seed
+from page_buffer import release_result
+from profiles import compile_layout, validate_params
+from reader import ParagraphReader, source_key
+from render import background_cache, band_height, render_page, render_and_save
+
+
+def count_characters(page):
+    """一页中的字数"""
+    return sum(len(line.glyphs) for line in page.lines)
+
+
+def output_dir_for(input_file, output_dir):
+    """单个文件的输出目录"""
+    return os.path.join(
+        output_dir,
+        f"handwritten_{os.path.splitext(os.path.basename(input_file))[0]}"
+    )
+
+
+def preview_params(input_file, output_dir, params):
+    """预览用的参数：没有指定随机种子时与转换一样沿用输出目录中上次的种子
+
+    这样预览排好的版与转换时的一致，转换直接使用，重新转换时没有修改的页保持原样
+    """
+    if params.get('seed') is not None or not input_file or not output_dir:
+        return params
+    return dict(params, seed=stored_seed(output_dir_for(input_file, output_dir), params))
+
+
+def process_pool(workers):
+    """渲染用的进程池
+
+    用 spawn 启动子进程：转换可能在任务队列的线程中进行，其他线程（别的文档的排版、预览）
+    可能正持有字体或字形缓存的锁，fork 出的子进程继承到已锁住的锁会永远等下去
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+# 每页统计中累加到整体统计的项
+STAT_TOTALS = ('layout', 'draw', 'encode', 'write', 'bytes', 'glyph_hits', 'glyph_misses')
+
+
+class DocumentConverter:
+    """文档转换流程（读取、排版、渲染），不依赖 PyQt6
+
+    events 为结构化事件回调，参数是一个字典，'event' 为事件类型：
+      'page'    每页写完（或因未变化跳过）时，含页码、字数、各阶段耗时 (layout/draw/encode/write，秒)、
+                写入字节数和字形缓存命中/未命中数
+      'resume'  从断点继续，含断点的页码（之前的页不再排版和渲染）
+      'done'    转换结束，含整体统计和字形缓存命中率
+      'profile' profile 打开时的 cProfile/tracemalloc 结果
+    事件可能在后台写盘线程中发出。profile 为 ('cpu', 'memory') 的子集，打开后在当前线程
+    渲染和写盘，以便分析器覆盖全部阶段。
+
+    多背景转换时由 VariantConverter 传入已排好的 pages、输出子目录 subdir 和共用的进程池 executor。
+
+    单页格式每连续写完一页就在输出目录中记录断点（见 manifest.Checkpoint）；参数 resume 为真时
+    从最后完成的页继续，参数或输入有变化时从头转换。
+    """
+    def __init__(self, input_file, output_dir, params, progress=None, events=None, profile=(),
+                 pages=None, subdir=None, executor=None):
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.params = params
+        self.pages = pages
+        self.subdir = subdir
+        self.executor = executor
+        self.progress = progress or (lambda value, message: None)
+        self.events = events
+        self.profile = tuple(profile)
+        self.page_stats = {}
+        self.totals = dict.fromkeys(STAT_TOTALS, 0)
+        self._stats_lock = threading.Lock()
+        self.fraction = lambda done: 0.0
+        self.missing_chars = set()
+        self.manifest = None
+        self.checkpoint = None
+        self.checkpoint_page = 0  # 该页及之前的页都已写完
+        self.checkpoint_characters = 0
+        self._completed = {}  # 已写完、但前面还有页未完成的页 -> 字数
+        self._positions = {}  # 页码 -> 该页在输入中的开始位置 (LayoutPosition)
+        self.pages_skipped = 0
+        self.characters_skipped = 0
+        self.is_running = True
+
+    def run(self):
+        """执行转换，返回页数和字数统计；打开 profile 时结果中附带分析报告"""
+        if not self.profile:
+            return self.convert()
+        import cProfile
+        import pstats
+        import tracemalloc
+
+        # 分析器只能看到当前线程，改为单进程、同步写盘
+        self.params = dict(self.params, workers=1)
+        profiler = cProfile.Profile() if 'cpu' in self.profile else None
+        if 'memory' in self.profile:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = self.convert()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            report = {}
+            if profiler is not None:
+                text = io.StringIO()
+                pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(30)
+                report['cpu'] = text.getvalue()
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                report['memory_peak'] = tracemalloc.get_traced_memory()[1]
+                report['memory'] = '\n'.join(str(stat) for stat in snapshot.statistics('lineno')[:20])
+                tracemalloc.stop()
+            self.emit('profile', **report)
+        result['profile'] = report
+        return result
+
+    def convert(self):
+        """读取、排版、渲染并写出所有页"""
+        start = time.perf_counter()
+        # 参数有误时在创建输出目录之前报错
+        self.params = validate_params(self.params)
+        # 创建输出目录
+        output_base = output_dir_for(self.input_file, self.output_dir)
+        if self.subdir:
+            output_base = os.path.join(output_base, self.subdir)
+        os.makedirs(output_base, exist_ok=True)
+
+        # 没有指定随机种子时沿用输出目录中上次的种子，未修改的页保持原样；预览按同样的规则取种子
+        if self.params.get('seed') is None:
+            seed = stored_seed(output_base, self.params)
+            if seed is not None:
+                self.params = dict(self.params, seed=seed)
+
+        # 预览已经排好版时直接复用，并沿用其随机种子（第一次转换时由预览随机选取），转换结果与预览一致
+        page_size = background_cache.page_size(self.params['background_path'])
+        pages = self.pages
+        if pages is None:
+            pages = layout_cache.find(source_key(self.input_file), self.params, page_size)
+        if pages and self.params.get('seed') is None:
+            self.params = dict(self.params, seed=pages[0].seed)
+
+        # 单页格式记录断点
+        if not is_multipage(self.params):
+            self.checkpoint = Checkpoint(output_base)
+
+        # 单页格式的输出目录中记录每页的输入，重新转换时跳过没有变化的页
+        if self.params.get('render_cache', True) and not is_multipage(self.params):
+            self.manifest = RenderManifest(output_base, self.params)
+
+        resume = None
+        if self.checkpoint is not None:
+            # 断点中要记下随机种子，这里先确定下来
+            if self.params.get('seed') is None:
+                self.params = dict(self.params, seed=document_seed(self.params))
+            self.checkpoint.begin(self.params, source_key(self.input_file))
+            if self.params.get('resume'):
+                resume = self.checkpoint.resume_point(lambda number: page_path(output_base, number, self.params))
+            if resume is not None:
+                # 断点之前的页都已写好，只计入统计
+                self.pages_skipped = self.checkpoint_page = resume['page']
+                self.characters_skipped = self.checkpoint_characters = resume['characters']
+                if self.manifest is not None:
+                    self.manifest.keep(resume['page'])
+                self.emit('resume', page=resume['page'])
+
+        # 排版：确定每页的行、字的位置和随机种子
+        if pages is not None:
+            # 预览已经排好版，直接复用
+            self.progress(20, "正在转换...")
+            total = len(pages)
+            self.fraction = lambda done: done / total
+        else:
+            # 边读边排版边渲染，内存占用与文档长度无关；从断点继续时之前的段落只读取不排版
+            self.progress(10, "正在读取文件...")
+            reader = ParagraphReader(self.input_file)
+            position = None
+            if resume is not None and resume['offset'] is not None:
+                offset = resume['offset']
+                position = LayoutPosition(resume['page'] + 1, offset['paragraph'], offset['line'],
+                                          resume['sizes_state'])
+            pages = iter_pages(reader, self.params, page_size, is_running=lambda: self.is_running,
+                               start=position, mark=self.mark_position if self.checkpoint is not None else None)
+            self.fraction = lambda done: reader.fraction
+        if resume is not None:
+            # 排好的页或断点中没有输入位置时，跳过已完成的页
+            pages = (page for page in pages if page.number > resume['page'])
+        pages = self.time_layout(pages)
+
+        # 渲染：各页相互独立，可并行
+        try:
+            page_count, characters = self.render_pages(self.check_glyphs(pages), output_base)
+        except BaseException:
+            if self.manifest is not None:
+                self.manifest.save()
+            raise
+        if self.manifest is not None:
+            self.manifest.save(page_count)
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+
+        lookups = self.totals['glyph_hits'] + self.totals['glyph_misses']
+        self.emit('done', pages=page_count, characters=characters, pages_skipped=self.pages_skipped,
+                  seconds=time.perf_counter() - start,
+                  glyph_hit_rate=self.totals['glyph_hits'] / lookups if lookups else None,
+                  **self.totals)
+        self.progress(100, "转换完成！")
+        return {
+            'output_dir': output_base,
+            'pages': page_count,
+            'characters': characters,
+            'missing_chars': ''.join(sorted(self.missing_chars)),
+            'pages_skipped': self.pages_skipped,
+            'resumed_from': resume['page'] if resume is not None else None,
+        }
+
+    def emit(self, event, **data):
+        """发出结构化事件"""
+        if self.events is not None:
+            self.events(dict(data, event=event, input=self.input_file))
+
+    def time_layout(self, pages):
+        """记录每页的排版耗时（边读边排版时包含读取时间）"""
+        pages = iter(pages)
+        while True:
+            start = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                return
+            self.page_stats[page.number] = {'layout': time.perf_counter() - start,
+                                            'characters': count_characters(page)}
+            yield page
+
+    def page_written(self, number, stats):
+        """一页写完：合并该页各阶段的统计并发出 'page' 事件"""
+        with self._stats_lock:
+            stats = dict(self.page_stats.pop(number, {}), **stats)
+            for key in STAT_TOTALS:
+                self.totals[key] += stats.get(key, 0)
+            self.advance_checkpoint(number, stats.get('characters', 0))
+        self.emit('page', number=number, **stats)
+
+    def mark_position(self, position):
+        """排版时记下每页在输入中的开始位置，写断点时使用"""
+        with self._stats_lock:
+            self._positions[position.page] = position
+
+    def advance_checkpoint(self, number, characters):
+        """一页写完（或跳过）：之前的页都已完成时推进断点并写入记录（调用时持有 _stats_lock）
+
+        多进程渲染时各页完成的顺序不定，断点只推进到连续完成的最后一页
+        """
+        if self.checkpoint is None:
+            return
+        self._completed[number] = characters
+        page = self.checkpoint_page
+        while page + 1 in self._completed:
+            page += 1
+            self.checkpoint_characters += self._completed.pop(page)
+            self._positions.pop(page, None)
+        if page == self.checkpoint_page:
+            return
+        self.checkpoint_page = page
+        self.checkpoint.save(page, self.checkpoint_characters, self._positions.get(page + 1), self.params['seed'])
+
+    def check_glyphs(self, pages):
+        """渲染前检查每页的字符，字体缺少的字形记入 missing_chars"""
+        font_path = self.params['font_path']
+        for page in pages:
+            self.missing_chars |= font_registry.missing_chars(
+                font_path, (char for line in page.lines for char, _ in line.glyphs))
+            yield page
+
+    def skip_unchanged(self, pages, output_base):
+        """跳过输出文件已是最新的页，只产出需要重新渲染的页"""
+        for page in pages:
+            if self.manifest is not None and self.manifest.is_current(
+                    page, page_path(output_base, page.number, self.params)):
+                self.pages_skipped += 1
+                self.characters_skipped += count_characters(page)
+                self.page_written(page.number, {'skipped': True})
+                self.page_done(0)
+                continue
+            yield page
+
+    def page_done(self, done):
+        """报告渲染进度；done 为已渲染的页数，跳过的页另外计入"""
+        done += self.pages_skipped
+        self.progress(min(99, int(20 + self.fraction(done) * 80)), f"已完成 {done} 页")
+
+    def render_pages(self, pages, output_base):
+        """渲染并保存所有页，多页时使用进程池；返回页数（含跳过的页）和字数"""
+        workers = self.params.get('workers') or os.cpu_count() or 1
+        banded = band_height(self.params) > 0
+        pages = self.skip_unchanged(pages, output_base)
+        # 只有一页时不必启动进程池
+        head = list(itertools.islice(pages, 2))
+        pages = itertools.chain(head, pages)
+        writer = PageWriter(output_base, self.params,
+                            max_pending=self.params.get('max_pending_pages', 2),
+                            threads=0 if self.profile else 2,
+                            is_running=lambda: self.is_running,
+                            on_written=self.page_written)
+        written = []  # 单进程渲染的页，写盘完成后记入清单
+        try:
+            if workers <= 1 or len(head) < 2:
+                done = characters = 0
+                for page in pages:
+                    if not self.is_running:
+                        raise InterruptedError("转换已取消")
+                    if banded:
+                        # 分条渲染边画边写，不经过后台写盘线程
+                        _, stats = render_and_save(page, self.params,
+                                                   page_path(output_base, page.number, self.params))
+                        self.page_written(page.number, stats)
+                    else:
+                        # 编码写盘在后台线程进行，与下一页的渲染重叠
+                        image = render_page(page, self.params, self.page_stats.setdefault(page.number, {}))
+                        writer.submit(page.number, image)
+                    written.append(page)
+                    done += 1
+                    characters += count_characters(page)
+                    self.page_done(done)
+            else:
+                done, characters = self.render_pages_parallel(pages, output_base, workers, writer)
+        except BaseException:
+            writer.close(cancel=True)
+            raise
+        writer.close()
+        for page in written:
+            self.record_page(page, output_base)
+        return done + self.pages_skipped, characters + self.characters_skipped
+
+    def record_page(self, page, output_base):
+        """记录已写入的页"""
+        if self.manifest is not None:
+            self.manifest.record(page, page_path(output_base, page.number, self.params))
+
+    def render_pages_parallel(self, pages, output_base, workers, writer):
+        """进程池渲染；同时在途的页数有限，避免排版结果和图像堆积在内存中"""
+        executor = self.executor or process_pool(workers)
+        pending = {}
+        try:
+            finished = {}  # 多页格式：已完成、等待按顺序写入的页
+            next_to_write = 1
+            done = characters = 0
+            while True:
+                while len(pending) + len(finished) < workers * 2:
+                    page = next(pages, None)
+                    if page is None:
+                        break
+                    output_path = page_path(output_base, page.number, self.params)
+                    pending[executor.submit(render_and_save, page, self.params, output_path)] = page
+                if not pending:
+                    break
+                if not self.is_running:
+                    raise InterruptedError("转换已取消")
+                completed, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    page = pending.pop(future)
+                    result, stats = future.result()
+                    if writer.multipage:
+                        # 子进程把像素留在共享内存中，这里直接解码，不经过 pickle
+                        self.page_stats.setdefault(page.number, {}).update(stats)
+                        finished[page.number] = result.to_image()
+                        result.release()
+                    else:
+                        # 子进程已写好文件
+                        self.record_page(page, output_base)
+                        self.page_written(page.number, stats)
+                    done += 1
+                    characters += count_characters(page)
+                    self.page_done(done)
+                while next_to_write in finished:
+                    writer.submit(next_to_write, finished.pop(next_to_write))
+                    next_to_write += 1
+            return done, characters
+        finally:
+            if executor is self.executor:
+                # 共用的进程池留给其他背景，只丢弃本次尚未开始的页
+                for future in pending:
+                    future.cancel()
+            else:
+                # 取消时不等待正在渲染的页，丢弃尚未开始的页
+                executor.shutdown(wait=self.is_running, cancel_futures=True)
+            # 已经开始渲染、不再取用的页，完成后释放其共享内存
+            for future in pending:
+                future.add_done_callback(release_result)
+
+    def stop(self):
+        """停止转换"""
+        self.is_running = False
+
+
+class VariantConverter:
+    """同一文档在多个背景上各转换一份，不依赖 PyQt6
+
+    variants 为每个背景的完整参数（见 profiles.variant_params）。文本只读取一次，排版参数和页面尺寸
+    相同的背景共用一次排版；各背景依次在同一进程（或同一个进程池）中渲染，字体和字号相同时
+    字形遮罩直接复用。输出写到 handwritten_<文件名>/<背景名>/ 下，事件中附带 'background'。
+    """
+    def __init__(self, input_file, output_dir, variants, progress=None, events=None):
+        self.input_file = input_file
+        self.output_dir = output_dir
+        self.variants = variants
+        self.progress = progress or (lambda value, message: None)
+        self.events = events
+        self.converter = None
+        self.is_running = True
+
+    def run(self):
+        """依次转换每个背景，返回各背景的结果和合计"""
+        self.progress(0, "正在读取文件...")
+        paragraphs = list(ParagraphReader(self.input_file))
+        output_base = output_dir_for(self.input_file, self.output_dir)
+        names = [os.path.splitext(os.path.basename(params['background_path']))[0] for params in self.variants]
+        seed = self.shared_seed(output_base, names)
+        count = len(self.variants)
+        # 先检查所有背景的参数，避免转换到后面的背景才发现配置有误
+        self.variants = [validate_params(params, name) for name, params in zip(names, self.variants)]
+        for params in self.variants:
+            compile_layout(params, background_cache.page_size(params['background_path']))
+
+        layouts = {}  # (排版参数, 页面尺寸) -> 排版结果
+        results = []
+        workers = max(params.get('workers') or os.cpu_count() or 1 for params in self.variants)
+        executor = process_pool(workers) if workers > 1 else None
+        try:
+            for index, (name, params) in enumerate(zip(names, self.variants)):
+                params = dict(params, seed=seed)
+                page_size = background_cache.page_size(params['background_path'])
+                key = layout_cache.params_key(params, page_size)
+                if key not in layouts:
+                    self.progress(int(index * 100 / count), f"[{name}] 正在排版...")
+                    layouts[key] = layout_document(paragraphs, params, page_size,
+                                                   is_running=lambda: self.is_running)
+                self.converter = DocumentConverter(
+                    self.input_file, self.output_dir, params,
+                    progress=lambda value, message, index=index, name=name: self.progress(
+                        int((index * 100 + value) / count), f"[{name}] {message}"),
+                    events=None if self.events is None else
+                    lambda event, name=name: self.events(dict(event, background=name)),
+                    pages=layouts[key], subdir=name, executor=executor)
+                if not self.is_running:
+                    raise InterruptedError("转换已取消")
+                results.append(dict(self.converter.run(), background=params['background_path']))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=self.is_running, cancel_futures=True)
+
+        self.progress(100, "转换完成！")
+        return {
+            'output_dir': output_base,
+            'pages': sum(result['pages'] for result in results),
+            'characters': sum(result['characters'] for result in results),
+            'missing_chars': ''.join(sorted(set(''.join(result['missing_chars'] for result in results)))),
+            'pages_skipped': sum(result['pages_skipped'] for result in results),
+            'variants': results,
+        }
+
+    def shared_seed(self, output_base, names):
+        """所有背景共用的随机种子：参数中的种子，其次沿用各背景输出目录中上次的种子（见 manifest.stored_seed）"""
+        params = self.variants[0]
+        if params.get('seed') is None:
+            for name, variant in zip(names, self.variants):
+                seed = stored_seed(os.path.join(output_base, name), variant)
+                if seed is not None:
+                    return seed
+        return document_seed(params)
+
+    def stop(self):
+        """停止转换"""
+        self.is_running = False
+        if self.converter is not None:
+            self.converter.stop()
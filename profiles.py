@@ -0,0 +1,201 @@
+"""参数配置：内置默认值、按背景和用户叠加的配置文件、校验，以及排版用的编译结果，不依赖 PyQt6
+
+配置按以下顺序叠加，后面的覆盖前面的：
+    内置默认值 < Parameter/default.json < Parameter/<背景名>.json < Parameter/Users/<用户>.json
+读取时即校验，错误的配置在加载时报错，而不是转换到一半才出错。
+"""
+import json
+import os
+from collections import namedtuple
+from page_writer import OUTPUT_FORMATS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PARAMETER_DIR = os.path.join(BASE_DIR, 'Parameter')
+USERS_DIR = os.path.join(PARAMETER_DIR, 'Users')
+DEFAULT_PROFILE = os.path.join(PARAMETER_DIR, 'default.json')
+
+# 内置默认值
+DEFAULT_PARAMS = {
+    'font_size': 40,
+    'line_spacing': 143,
+    'word_spacing': 5,
+    'left_margin': 180,
+    'right_margin': 100,
+    'top_margin': 140,
+    'bottom_margin': 70,
+    'word_spacing_sigma': 2,
+    'line_spacing_sigma': 0,
+    'perturb_x_sigma': 3,
+    'perturb_y_sigma': 3,
+    'perturb_theta_sigma': 0.05,
+}
+
+# 数值参数：(类型, 最小值, 最大值)，None 表示不限；int 参数接受 80.0 这样的整数值浮点数
+NUMBER_PARAMS = {
+    'font_size': (int, 1, None),
+    'line_spacing': (int, 0, None),
+    'word_spacing': (int, None, None),
+    'left_margin': (int, 0, None),
+    'right_margin': (int, 0, None),
+    'top_margin': (int, 0, None),
+    'bottom_margin': (int, 0, None),
+    'font_size_sigma': (float, 0, None),
+    'font_size_buckets': (int, 1, None),
+    'word_spacing_sigma': (float, 0, None),
+    'line_spacing_sigma': (float, 0, None),
+    'perturb_x_sigma': (float, 0, None),
+    'perturb_y_sigma': (float, 0, None),
+    'perturb_theta_sigma': (float, 0, None),
+    'ink_opacity': (float, 0, 1),
+    'ink_pressure_sigma': (float, 0, None),
+    'png_compress_level': (int, 0, 9),
+    'quality': (int, 1, 100),
+    'band_height': (int, 0, None),
+    'workers': (int, 0, None),
+    'max_pending_pages': (int, 1, None),
+    'seed': (int, 0, None),
+}
+
+# 排版用的参数，由 compile_layout 按页面尺寸算好，不可修改
+PageGeometry = namedtuple('PageGeometry', [
+    'font_path', 'font_size', 'word_spacing', 'line_spacing', 'paragraph_spacing',
+    'left_margin', 'top_margin', 'max_width', 'bottom_limit', 'usable_height', 'slack', 'jitter',
+    'size_sigma', 'size_buckets',
+])
+# 字号抖动默认的档位数
+DEFAULT_SIZE_BUCKETS = 5
+
+
+class ProfileError(ValueError):
+    """参数配置无效"""
+
+
+def validate_params(params, source='参数'):
+    """校验参数并规范数值类型，返回新的字典；有错误时抛出 ProfileError"""
+    params = dict(params)
+    errors = []
+    for name, (kind, low, high) in NUMBER_PARAMS.items():
+        value = params.get(name)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append(f"{name} 应为数字: {value!r}")
+            continue
+        if kind is int:
+            if value != int(value):
+                errors.append(f"{name} 应为整数: {value}")
+                continue
+            value = int(value)
+        if (low is not None and value < low) or (high is not None and value > high):
+            errors.append(f"{name} 超出范围 [{'' if low is None else low}, {'' if high is None else high}]: {value}")
+            continue
+        params[name] = value
+    fmt = params.get('output_format')
+    if fmt is not None and str(fmt).lower() not in OUTPUT_FORMATS:
+        errors.append(f"output_format 不支持: {fmt!r}")
+    if errors:
+        raise ProfileError(f"{source}: " + '；'.join(errors))
+    return params
+
+
+def read_profile(path):
+    """读取并校验一个配置文件"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise ProfileError(f"{path}: 不是有效的 JSON ({e})")
+    if not isinstance(data, dict):
+        raise ProfileError(f"{path}: 应为 JSON 对象")
+    return validate_params(data, path)
+
+
+def background_profile(background_path):
+    """背景对应的参数配置 Parameter/<背景名>.json 的路径，没有时返回 None"""
+    name = os.path.splitext(os.path.basename(background_path))[0]
+    path = os.path.join(PARAMETER_DIR, f"{name}.json")
+    return path if os.path.exists(path) else None
+
+
+def user_profile(user):
+    """用户配置 Parameter/Users/<用户>.json 的路径"""
+    path = os.path.join(USERS_DIR, f"{user}.json")
+    if not os.path.exists(path):
+        raise ProfileError(f"找不到用户配置: {user}")
+    return path
+
+
+def list_users():
+    """Parameter/Users/ 下的用户配置名"""
+    if not os.path.isdir(USERS_DIR):
+        return []
+    return [os.path.splitext(name)[0] for name in sorted(os.listdir(USERS_DIR)) if name.endswith('.json')]
+
+
+def load_profile(background_path=None, user=None, base=DEFAULT_PROFILE):
+    """按背景和用户叠加参数配置：内置默认值 < base < 背景配置 < 用户配置"""
+    params = dict(DEFAULT_PARAMS)
+    paths = [base] if base and os.path.exists(base) else []
+    if background_path:
+        paths.append(background_profile(background_path))
+    if user:
+        paths.append(user_profile(user))
+    for path in paths:
+        if path is not None:
+            params.update(read_profile(path))
+    return params
+
+
+def variant_params(params, background_paths, user=None):
+    """每个背景一份参数：在 params 上叠加该背景自己的参数配置，再叠加用户配置"""
+    variants = []
+    for background_path in background_paths:
+        variant = dict(params)
+        for path in (background_profile(background_path), user_profile(user) if user else None):
+            if path is not None:
+                variant.update(read_profile(path))
+        variant['background_path'] = background_path
+        variants.append(variant)
+    return variants
+
+
+def size_buckets(font_size, sigma, count=DEFAULT_SIZE_BUCKETS):
+    """字号抖动的档位：在 font_size ± 2σ 内均匀取 count 个整数字号；不抖动时为空"""
+    if not sigma or count <= 1:
+        return ()
+    sizes = sorted({max(1, int(round(font_size + sigma * (4 * k / (count - 1) - 2)))) for k in range(count)})
+    return tuple(sizes) if len(sizes) > 1 else ()
+
+
+def compile_layout(params, page_size):
+    """把排版参数编译为 PageGeometry：校验并按页面尺寸算出可用宽度、页底位置等"""
+    params = validate_params(params)
+    missing = [name for name in ('font_path', 'font_size', 'word_spacing', 'line_spacing', 'left_margin',
+                                 'right_margin', 'top_margin', 'bottom_margin') if params.get(name) is None]
+    if missing:
+        raise ProfileError(f"缺少参数: {', '.join(missing)}")
+    width, height = page_size
+    font_size = params['font_size']
+    max_width = width - params['left_margin'] - params['right_margin']
+    usable_height = height - params['top_margin'] - params['bottom_margin']
+    if max_width < font_size:
+        raise ProfileError(f"左右边距过大：页宽 {width}，可用宽度 {max_width} 小于字号 {font_size}")
+    if usable_height < font_size:
+        raise ProfileError(f"上下边距过大：页高 {height}，可用高度 {usable_height} 小于字号 {font_size}")
+    return PageGeometry(
+        font_path=params['font_path'],
+        font_size=font_size,
+        word_spacing=params['word_spacing'],
+        line_spacing=params['line_spacing'],
+        paragraph_spacing=params['line_spacing'] * 1.5,
+        left_margin=params['left_margin'],
+        top_margin=params['top_margin'],
+        max_width=max_width,
+        bottom_limit=height - params['bottom_margin'],
+        usable_height=usable_height,
+        slack=2 * params.get('perturb_x_sigma', 0),
+        jitter=params.get('word_spacing_sigma', 0),
+        size_sigma=params.get('font_size_sigma', 0),
+        size_buckets=size_buckets(font_size, params.get('font_size_sigma', 0),
+                                  params.get('font_size_buckets', DEFAULT_SIZE_BUCKETS)),
+    )
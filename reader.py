@@ -0,0 +1,142 @@
+import codecs
+import os
+import zipfile
+from xml.etree import ElementTree
+
+# 支持的输入格式
+SUPPORTED_EXTS = ('.txt', '.doc', '.docx')
+
+# docx 正文的 XML 命名空间
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# 按 BOM 判断的编码，长的 BOM 放前面
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def detect_encoding(file_path, sample_size=64 * 1024):
+    """检测文本文件编码：先看 BOM，再依次尝试 utf-8、gb18030"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in ('utf-8', 'gb18030'):
+        try:
+            # 样本末尾可能截断在多字节字符中间，不作为最终块解码
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'latin-1'
+
+
+def source_key(file_path):
+    """文件的身份：路径、修改时间和大小，文件变化后随之改变"""
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime, stat.st_size)
+
+
+class ParagraphReader:
+    """逐段读取输入文件，不会把整个文件读入内存"""
+    def __init__(self, file_path):
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"找不到文件: {file_path}")
+        self.file_path = file_path
+        self.file_ext = os.path.splitext(file_path)[1].lower()
+        if self.file_ext not in SUPPORTED_EXTS:
+            raise ValueError(f"不支持的文件格式: {self.file_ext}")
+        self.paragraphs_read = 0
+        self._position = lambda: 0
+        self._total = 0
+
+    @property
+    def fraction(self):
+        """已读取的比例 (0~1)，用于估算进度"""
+        if not self._total:
+            return 0.0
+        return min(1.0, self._position() / self._total)
+
+    def __iter__(self):
+        if self.file_ext == '.txt':
+            paragraphs = self._iter_txt()
+        elif self.file_ext == '.docx':
+            paragraphs = self._iter_docx()
+        else:
+            paragraphs = self._iter_legacy()
+        try:
+            for paragraph in paragraphs:
+                self.paragraphs_read += 1
+                yield paragraph
+        finally:
+            # 文件已关闭，之后按读完计算
+            self._position = lambda: self._total
+
+    def _iter_txt(self):
+        encoding = detect_encoding(self.file_path)
+        self._total = os.path.getsize(self.file_path)
+        with open(self.file_path, 'r', encoding=encoding, errors='replace') as f:
+            self._position = f.buffer.tell
+            for line in f:
+                yield line.rstrip('\n')
+
+    def _iter_docx(self):
+        with zipfile.ZipFile(self.file_path) as archive:
+            self._total = archive.getinfo('word/document.xml').file_size
+            with archive.open('word/document.xml') as xml:
+                self._position = xml.tell
+                parts = []
+                body = None
+                for event, elem in ElementTree.iterparse(xml, events=('start', 'end')):
+                    if event == 'start':
+                        if elem.tag == W_NS + 'body':
+                            body = elem
+                        elif elem.tag == W_NS + 'p':
+                            parts = []
+                        continue
+                    if elem.tag == W_NS + 't':
+                        parts.append(elem.text or '')
+                    elif elem.tag == W_NS + 'tab':
+                        parts.append('\t')
+                    elif elem.tag in (W_NS + 'br', W_NS + 'cr'):
+                        parts.append('\n')
+                    elif elem.tag == W_NS + 'p':
+                        # 段内换行拆成多个段落，与纯文本的处理一致
+                        yield from ''.join(parts).split('\n')
+                        parts = []
+                        # 丢弃已处理的元素，内存不随文档增长
+                        elem.clear()
+                        if body is not None:
+                            body.clear()
+
+    def _iter_legacy(self):
+        # 旧版 .doc 无法流式解析，交给 docx2txt 整体读取
+        import docx2txt
+        yield from docx2txt.process(self.file_path).split('\n')
+
+
+def collect_inputs(paths, recursive=False):
+    """展开输入路径，目录中只取支持的文件"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for root, _, names in os.walk(path):
+                    files.extend(os.path.join(root, name) for name in sorted(names)
+                                 if name.lower().endswith(SUPPORTED_EXTS))
+            else:
+                files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if name.lower().endswith(SUPPORTED_EXTS))
+        else:
+            files.append(path)
+    return files
+
+
+def read_text_from_file(file_path):
+    """读取文件的全部内容（预览等需要完整文本时使用）"""
+    return '\n'.join(ParagraphReader(file_path))
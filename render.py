@@ -0,0 +1,483 @@
+from collections import OrderedDict, namedtuple
+from PIL import Image, ImageColor, ImageDraw
+import math
+import os
+import threading
+import time
+import numpy as np
+from font_registry import font_registry
+from page_buffer import PageBuffer
+from page_writer import encode_page, is_multipage, output_format, save_page, write_png_bands
+
+# 背景超过该像素数（约 600 DPI 的 A4）且输出 png 时自动分条渲染
+BAND_AUTO_PIXELS = 24 * 1000 * 1000
+DEFAULT_BAND_HEIGHT = 256
+
+# 旋转角度的档位数（含不旋转），在 ±2σ 内均匀分布；每个字最多缓存这么多个旋转后的遮罩
+ROTATION_BUCKETS = 5
+
+# 缓存的字形：alpha 遮罩、相对绘制点的偏移、前进宽度
+Glyph = namedtuple('Glyph', ['mask', 'offset', 'advance'])
+
+
+class GlyphCache:
+    """字形缓存，每个 (字体, 字号, 字符) 只光栅化一次"""
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._glyphs = OrderedDict()
+        self._advances = {}
+        self._ascents = {}
+        # 预览线程和转换线程共用同一个缓存
+        self._lock = threading.RLock()
+
+    def get_font(self, font_path, font_size):
+        """获取字体对象，由字体登记表统一加载"""
+        return font_registry.get_font(font_path, font_size)
+
+    def get(self, font_path, font_size, char, rotation=0):
+        """获取字形，未命中时光栅化并按 LRU 淘汰
+
+        rotation 为量化后的旋转角度（度，见 rotation_angles），旋转后的遮罩同样缓存；
+        一次调用只计一次命中或未命中
+        """
+        with self._lock:
+            glyph = self._lookup(font_path, font_size, char, rotation)
+            if glyph is not None:
+                self.hits += 1
+                return glyph
+            self.misses += 1
+            if rotation:
+                upright = self._lookup(font_path, font_size, char, 0)
+                if upright is None:
+                    upright = self._store((font_path, font_size, char, 0),
+                                          self._rasterize(self.get_font(font_path, font_size), char))
+                glyph = self._rotate(upright, rotation)
+            else:
+                glyph = self._rasterize(self.get_font(font_path, font_size), char)
+            return self._store((font_path, font_size, char, rotation), glyph)
+
+    def _lookup(self, font_path, font_size, char, rotation):
+        """查找缓存，不计入命中统计（调用时持有锁）"""
+        key = (font_path, font_size, char, rotation)
+        glyph = self._glyphs.get(key)
+        if glyph is not None:
+            self._glyphs.move_to_end(key)
+        return glyph
+
+    def _store(self, key, glyph):
+        """加入缓存并按 LRU 淘汰（调用时持有锁）"""
+        self._glyphs[key] = glyph
+        self.current_bytes += self._size_of(glyph)
+        while self.current_bytes > self.max_bytes and len(self._glyphs) > 1:
+            _, old = self._glyphs.popitem(last=False)
+            self.current_bytes -= self._size_of(old)
+        return glyph
+
+    def advance(self, font_path, font_size, char):
+        """字符的前进宽度，排版时使用，不需要光栅化"""
+        with self._lock:
+            key = (font_path, font_size, char)
+            advance = self._advances.get(key)
+            if advance is None:
+                glyph = self._glyphs.get(key + (0,))
+                if glyph is not None:
+                    advance = glyph.advance
+                else:
+                    advance = self.get_font(font_path, font_size).getlength(char)
+                self._advances[key] = advance
+            return advance
+
+    def ascent(self, font_path, font_size):
+        """字体在该字号下基线到顶部的距离，字号不同的字按基线对齐时使用"""
+        with self._lock:
+            key = (font_path, font_size)
+            ascent = self._ascents.get(key)
+            if ascent is None:
+                ascent = self._ascents[key] = self.get_font(font_path, font_size).getmetrics()[0]
+            return ascent
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._glyphs.clear()
+            self._advances.clear()
+            self._ascents.clear()
+            self.current_bytes = 0
+
+    @staticmethod
+    def _rasterize(font, char):
+        # 与 draw.text 默认锚点 'la' 一致，遮罩只覆盖字形的包围盒
+        advance = font.getlength(char)
+        left, top, right, bottom = font.getbbox(char)
+        if right <= left or bottom <= top:
+            return Glyph(None, (0, 0), advance)
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255)
+        return Glyph(mask, (left, top), advance)
+
+    @staticmethod
+    def _rotate(glyph, degrees):
+        # 绕字形中心旋转，扩展遮罩以免裁掉笔画
+        if glyph.mask is None:
+            return glyph
+        mask = glyph.mask.rotate(degrees, resample=Image.Resampling.BICUBIC, expand=True)
+        offset = (
+            glyph.offset[0] + (glyph.mask.width - mask.width) // 2,
+            glyph.offset[1] + (glyph.mask.height - mask.height) // 2,
+        )
+        return Glyph(mask, offset, glyph.advance)
+
+    @staticmethod
+    def _size_of(glyph):
+        if glyph.mask is None:
+            return 0
+        return glyph.mask.width * glyph.mask.height
+
+
+# 进程内共享的字形缓存
+glyph_cache = GlyphCache()
+
+
+class BackgroundCache:
+    """背景模板缓存，按 (路径, 修改时间, 目标尺寸) 保存解码后的 RGB 图像"""
+    def __init__(self, max_items=8):
+        self.max_items = max_items
+        self._templates = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def get(self, path, size=None):
+        """获取解码后的背景模板（只读，绘制前请先 copy）"""
+        with self._lock:
+            key = (path, os.path.getmtime(path), size)
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+
+            if size is None:
+                image = Image.open(path)
+                if image.mode == 'RGB':
+                    # 已是 RGB 时直接解码，避免 convert 再复制一份整图
+                    image.load()
+                    template = image
+                else:
+                    with image:
+                        template = image.convert('RGB')
+            else:
+                template = self.get(path).resize(size)
+            self._templates[key] = template
+            while len(self._templates) > self.max_items:
+                self._templates.popitem(last=False)
+            return template
+
+    def new_page(self, path, size=None):
+        """以模板副本创建新页"""
+        return self.get(path, size).copy()
+
+    def page_size(self, path):
+        """背景原始尺寸，只读取文件头"""
+        with self._lock:
+            key = (path, os.path.getmtime(path))
+            size = self._sizes.get(key)
+            if size is None:
+                with Image.open(path) as image:
+                    size = image.size
+                self._sizes[key] = size
+            return size
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._templates.clear()
+            self._sizes.clear()
+
+
+# 进程内共享的背景缓存
+background_cache = BackgroundCache()
+
+
+def rotation_angles(thetas, sigma, count=ROTATION_BUCKETS):
+    """把弧度角量化为 ±2σ 内的 count 个旋转角度（度），0 为不旋转
+
+    与字号抖动的档位一样，档位数与 σ 无关，每个字最多旋转 count - 1 次，冷启动的开销有上限
+    """
+    if not sigma or count <= 1:
+        return [0] * len(thetas)
+    half = (count - 1) // 2
+    step = 2 * math.degrees(sigma) / half
+    buckets = np.clip(np.rint(np.degrees(thetas) / step), -half, half)
+    return (buckets * step).tolist()
+
+
+def draw_glyph(image, glyph, x, y, fill=(0, 0, 0)):
+    """把缓存的字形遮罩以指定颜色合成到图像上"""
+    if glyph.mask is None:
+        return
+    position = (int(round(x)) + glyph.offset[0], int(round(y)) + glyph.offset[1])
+    image.paste(fill, position, glyph.mask)
+
+
+def page_rng(page):
+    """该页的随机数生成器，由文档种子和页码决定，与渲染顺序、进程无关"""
+    return np.random.default_rng([page.seed, page.number])
+
+
+def place_glyphs(page, params):
+    """在排版位置上加入该页的随机扰动，返回 [(字符, x, y, 角度), ...]
+
+    预览和正式渲染共用，保证两者的字形位置一致；整页的扰动一次性采样
+    """
+    counts = [len(line.glyphs) for line in page.lines]
+    total = sum(counts)
+    if not total:
+        return []
+
+    rng = page_rng(page)
+    # 每个字一行：x、y、角度、字间距扰动
+    sigmas = np.array([params['perturb_x_sigma'], params['perturb_y_sigma'],
+                       params['perturb_theta_sigma'], params['word_spacing_sigma']], dtype=float)
+    jitter = rng.standard_normal((total, 4)) * sigmas
+    line_jitter = rng.standard_normal(len(counts)) * params['line_spacing_sigma']
+
+    # 字间距扰动在行内累积（每行第一个字不偏移），行间距扰动在页内累积
+    spacing = np.concatenate(([0.0], np.cumsum(jitter[:-1, 3])))
+    line_starts = np.repeat(np.cumsum([0] + counts[:-1]), counts)
+    spacing -= spacing[line_starts]
+    line_offset = np.concatenate(([0.0], np.cumsum(line_jitter[:-1])))
+
+    base_x = np.fromiter((x for line in page.lines for _, x in line.glyphs), dtype=float, count=total)
+    base_y = np.repeat(np.array([line.y for line in page.lines], dtype=float) + line_offset, counts)
+    xs = (base_x + spacing + jitter[:, 0]).tolist()
+    ys = (base_y + jitter[:, 1]).tolist()
+    thetas = jitter[:, 2].tolist()
+    chars = [char for line in page.lines for char, _ in line.glyphs]
+    return list(zip(chars, xs, ys, thetas))
+
+
+def ink_color(params):
+    """墨水颜色 (R, G, B)；参数 ink_color 可以是 '#rrggbb' 或 [r, g, b]，默认黑色"""
+    color = params.get('ink_color') or (0, 0, 0)
+    if isinstance(color, str):
+        return ImageColor.getrgb(color)[:3]
+    return tuple(int(value) for value in color)[:3]
+
+
+def glyph_inks(page, count, params):
+    """每个字的墨水浓度 (0~255)，按 ink_pressure_sigma 模拟笔压
+
+    使用独立的随机流，开关笔压不会改变字形位置
+    """
+    sigma = float(params.get('ink_pressure_sigma') or 0)
+    if not sigma:
+        return [255] * count
+    rng = np.random.default_rng([page.seed, page.number, 1])
+    pressure = np.clip(1 - np.abs(rng.standard_normal(count)) * sigma, 0.3, 1.0)
+    return np.rint(pressure * 255).astype(int).tolist()
+
+
+def page_sizes(page, font_size, scale=1.0):
+    """本页每个字绘制时的字号（按 scale 缩放）；没有字号抖动时返回 None"""
+    if not any(line.sizes for line in page.lines):
+        return None
+    scaled = {}
+    sizes = []
+    for line in page.lines:
+        for size in line.sizes or [font_size] * len(line.glyphs):
+            value = scaled.get(size)
+            if value is None:
+                value = scaled[size] = max(1, int(size * scale))
+            sizes.append(value)
+    return sizes
+
+
+def page_glyphs(page, params, font_size=None, scale=1.0):
+    """本页要绘制的字形 [(字形, x, y, 浓度), ...]，位置已按 scale 缩放并取整"""
+    font_path = params['font_path']
+    font_size = font_size or params['font_size']
+    placed = place_glyphs(page, params)
+    inks = glyph_inks(page, len(placed), params)
+    sizes = page_sizes(page, params['font_size'], scale)
+    # 旋转角度量化为少数几个档位，复用旋转好的遮罩
+    angles = rotation_angles([theta for _, _, _, theta in placed], params['perturb_theta_sigma'])
+    glyphs = []
+    if sizes is None:
+        for (char, x, y, _), ink, angle in zip(placed, inks, angles):
+            glyph = glyph_cache.get(font_path, font_size, char, angle)
+            if glyph.mask is not None:
+                glyphs.append((glyph, int(round(x * scale)), int(round(y * scale)), ink))
+        return glyphs
+
+    # 字号抖动：每个档位的字形各自缓存，按基线与基准字号对齐
+    base_ascent = glyph_cache.ascent(font_path, font_size)
+    shifts = {}
+    for (char, x, y, _), ink, size, angle in zip(placed, inks, sizes, angles):
+        shift = shifts.get(size)
+        if shift is None:
+            shift = shifts[size] = base_ascent - glyph_cache.ascent(font_path, size)
+        glyph = glyph_cache.get(font_path, size, char, angle)
+        if glyph.mask is not None:
+            glyphs.append((glyph, int(round(x * scale)), int(round(y * scale)) + shift, ink))
+    return glyphs
+
+
+def ink_mask(size, glyphs, top=0):
+    """把字形累积到一张 8 位墨水遮罩上；top 为遮罩第一行在页面中的位置"""
+    mask = Image.new('L', size, 0)
+    for glyph, x, y, ink in glyphs:
+        draw_glyph(mask, glyph, x, y - top, ink)
+    return mask
+
+
+def render_ink_mask(page, params):
+    """整页的墨水遮罩，可以用 composite_ink 合成到任意同尺寸的背景上"""
+    return ink_mask(background_cache.page_size(params['background_path']), page_glyphs(page, params))
+
+
+def composite_ink(image, mask, params):
+    """按 ink_color 和 ink_opacity 把墨水遮罩一次合成到图像上"""
+    opacity = float(params.get('ink_opacity', 1.0))
+    if opacity < 1:
+        mask = mask.point([int(round(value * opacity)) for value in range(256)])
+    # 只合成有墨水的区域
+    box = mask.getbbox()
+    if box is not None:
+        image.paste(ink_color(params), box, mask.crop(box))
+
+
+def draw_glyphs(image, glyphs, params, top=0):
+    """把字形画到图像上
+
+    ink_mask 模式下先把所有字形累积到 8 位遮罩，再按墨水颜色、不透明度一次合成；
+    否则逐字直接以墨水颜色画到背景上
+    """
+    if params.get('ink_mask'):
+        composite_ink(image, ink_mask(image.size, glyphs, top), params)
+        return
+    color = ink_color(params)
+    for glyph, x, y, ink in glyphs:
+        draw_glyph(image, glyph, x, y - top, color)
+
+
+def render_page(page, params, stats=None):
+    """按排版结果渲染一页，返回页面图像
+
+    stats 为字典时记入绘制耗时 'draw' 和本页的字形缓存命中/未命中数
+    """
+    start = time.perf_counter()
+    hits, misses = glyph_cache.hits, glyph_cache.misses
+    background = background_cache.new_page(params['background_path'])
+    draw_glyphs(background, page_glyphs(page, params), params)
+
+    if stats is not None:
+        stats['draw'] = time.perf_counter() - start
+        stats['glyph_hits'] = glyph_cache.hits - hits
+        stats['glyph_misses'] = glyph_cache.misses - misses
+    return background
+
+
+def band_height(params):
+    """分条渲染的条高（行数），0 表示整页渲染
+
+    只有 png 可以逐条编码；参数中没有 band_height 时，背景很大才自动分条
+    """
+    if output_format(params) != 'png':
+        return 0
+    height = params.get('band_height')
+    if height is None:
+        width, page_height = background_cache.page_size(params['background_path'])
+        height = DEFAULT_BAND_HEIGHT if width * page_height > BAND_AUTO_PIXELS else 0
+    return int(height)
+
+
+def render_bands(page, params, height, stats=None):
+    """按横条渲染一页，从上到下依次产出 RGB 横条
+
+    每次只复制一条背景，内存占用与整页大小无关；跨条的字形在相邻两条中各画一部分。
+    stats 的内容与 render_page 相同，在最后一条产出后写入
+    """
+    start = time.perf_counter()
+    hits, misses = glyph_cache.hits, glyph_cache.misses
+    template = background_cache.get(params['background_path'])
+    width, page_height = template.size
+
+    # 按字形遮罩覆盖的行把字形分到各条
+    bands = [[] for _ in range((page_height + height - 1) // height)]
+    for item in page_glyphs(page, params):
+        glyph, x, y, ink = item
+        top = y + glyph.offset[1]
+        first = max(0, top // height)
+        last = min(len(bands) - 1, (top + glyph.mask.height - 1) // height)
+        for index in range(first, last + 1):
+            bands[index].append(item)
+
+    draw = time.perf_counter() - start
+    for index, glyphs in enumerate(bands):
+        start = time.perf_counter()
+        top = index * height
+        band = template.crop((0, top, width, min(top + height, page_height)))
+        draw_glyphs(band, glyphs, params, top)
+        draw += time.perf_counter() - start
+        yield band
+
+    if stats is not None:
+        stats['draw'] = draw
+        stats['glyph_hits'] = glyph_cache.hits - hits
+        stats['glyph_misses'] = glyph_cache.misses - misses
+
+
+def render_to_buffer(page, params, stats=None):
+    """按横条渲染一页，直接写入共享内存中的 PageBuffer，子进程中不生成整页图像
+
+    主进程取得结果后负责 release；stats 的内容与 render_page 相同
+    """
+    buffer = PageBuffer(background_cache.page_size(params['background_path']), shared=True)
+    top = 0
+    for band in render_bands(page, params, DEFAULT_BAND_HEIGHT, stats):
+        buffer.write(band, top)
+        top += band.height
+    return buffer
+
+
+def render_and_save(page, params, output_path):
+    """渲染并保存一页，供子进程调用，返回 (结果, 耗时统计)
+
+    多页格式由主进程按顺序写入，结果为共享内存中的 PageBuffer；否则为输出路径
+    """
+    stats = {}
+    if is_multipage(params):
+        return render_to_buffer(page, params, stats), stats
+    height = band_height(params)
+    if height:
+        size = background_cache.page_size(params['background_path'])
+        stats.update(write_png_bands(output_path, size, render_bands(page, params, height, stats), params))
+        return output_path, stats
+    image = render_page(page, params, stats)
+    stats.update(save_page(image, output_path, params))
+    return output_path, stats
+
+
+def render_encoded(page, params):
+    """渲染一页并编码为字节，供常驻的子进程调用
+
+    多页格式返回共享内存中的 PageBuffer，由主进程合成一个文件
+    """
+    if is_multipage(params):
+        return render_to_buffer(page, params)
+    image = render_page(page, params)
+    return encode_page(image, params).getvalue()
+
+
+def warm_caches(fonts, background_paths, chars):
+    """预先载入背景、字体和常用字形，fonts 为 [(字体路径, 字号), ...]
+
+    作为常驻进程的初始化函数，之后的请求不再承担冷启动的开销
+    """
+    for path in background_paths:
+        background_cache.get(path)
+    for font_path, font_size in fonts:
+        for char in chars:
+            glyph_cache.get(font_path, font_size, char)
@@ -0,0 +1,386 @@
+"""本地渲染服务（asyncio，HTTP over TCP 或 Unix socket），不依赖 PyQt6
+
+服务常驻运行，渲染在一组预热过的子进程中进行：字体、背景和字形缓存一直留在内存里，
+短小的单页请求不再承担冷启动的开销。
+
+接口：
+    POST /render    请求体为 JSON：
+                      text     要转换的文本（必填）
+                      profile  参数配置名，即背景名（如 "背景1"），默认为第一个背景
+                      user     叠加的用户配置 Parameter/Users/<用户>.json
+                      font     fonts/ 下的字体文件名，默认为第一个字体
+                      format   png/jpeg/webp/pdf/tiff，默认 png
+                      params   其他覆盖的参数，如 {"seed": 1, "png_compress_level": 1}
+                    单页格式以 multipart/mixed 分块返回，每页渲染完成就按页码顺序发出；
+                    pdf/tiff 在所有页完成后作为一个文件返回
+    GET  /metrics   并发、排队深度、页数和平均耗时等统计
+    GET  /profiles  可用的参数配置、用户配置和字体
+
+用法示例：
+    python -m service --port 8765 --workers 4
+    python -m service --unix /tmp/handwriting.sock
+    curl -s localhost:8765/render -d '{"text": "你好", "profile": "背景1"}' -o pages.multipart
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from layout import layout_document
+from page_buffer import release_result
+from page_writer import OUTPUT_FORMATS, encode_document, is_multipage, output_format
+from profiles import ProfileError, compile_layout, list_users, load_profile, validate_params
+from render import background_cache, render_encoded, warm_caches
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FONTS_DIR = os.path.join(BASE_DIR, 'fonts')
+BACKGROUND_DIR = os.path.join(BASE_DIR, 'Background')
+
+# 预热时载入的字形：ASCII 和常用标点
+WARM_CHARS = ''.join(chr(code) for code in range(0x21, 0x7F)) + '，。、；：？！“”‘’（）《》…—'
+# 请求体上限
+MAX_BODY = 16 * 1024 * 1024
+MULTIPART_BOUNDARY = 'handwriting-page'
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+MIME_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp',
+              'pdf': 'application/pdf', 'tiff': 'image/tiff'}
+
+
+class RequestError(Exception):
+    """请求无效，以 status 返回给客户端"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def list_files(folder, exts):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder) if name.lower().endswith(exts))
+
+
+class RenderService:
+    """渲染服务：同时处理最多 max_requests 个请求，另有最多 max_queue 个排队，超出时返回 503
+
+    每个请求最多同时有 workers 页在子进程中渲染，页按顺序发回。
+    """
+    def __init__(self, workers=None, max_requests=4, max_queue=32):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_requests = max_requests
+        self.max_queue = max_queue
+        self.fonts = list_files(FONTS_DIR, ('.ttf', '.otf'))
+        self.backgrounds = list_files(BACKGROUND_DIR, ('.png', '.jpg', '.jpeg'))
+        self.pool = None
+        self.slots = None
+        self.started = time.time()
+        self.stats = {
+            'requests_total': 0, 'requests_failed': 0, 'requests_rejected': 0,
+            'requests_active': 0, 'requests_queued': 0, 'pages_rendered': 0, 'pages_in_flight': 0,
+            'seconds_total': 0.0, 'first_page_seconds_total': 0.0, 'requests_with_pages': 0,
+        }
+
+    def warm_specs(self):
+        """预热内容：每个背景，以及每个字体在每个背景配置下的字号"""
+        backgrounds = [os.path.join(BACKGROUND_DIR, name) for name in self.backgrounds]
+        sizes = sorted({load_profile(path)['font_size'] for path in backgrounds} or {load_profile()['font_size']})
+        fonts = [(os.path.join(FONTS_DIR, name), size) for name in self.fonts for size in sizes]
+        return fonts, backgrounds, WARM_CHARS
+
+    async def start(self):
+        """启动并预热渲染进程（主进程也预热，排版要用到字宽）"""
+        loop = asyncio.get_running_loop()
+        specs = self.warm_specs()
+        self.slots = asyncio.Semaphore(self.max_requests)
+        # 用 spawn 启动子进程：事件循环所在进程有其他线程（可能正持有缓存的锁），fork 出的子进程会死锁
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=warm_caches, initargs=specs)
+        # 每个进程都先执行一次初始化，第一个请求不必等待进程启动
+        await asyncio.gather(loop.run_in_executor(None, warm_caches, *specs),
+                             *(loop.run_in_executor(self.pool, os.getpid) for _ in range(self.workers)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self):
+        stats = self.stats
+        finished = stats['requests_total'] - stats['requests_active'] - stats['requests_queued']
+        with_pages = stats['requests_with_pages']
+        return {
+            'uptime': round(time.time() - self.started, 1),
+            'workers': self.workers,
+            'max_requests': self.max_requests,
+            'max_queue': self.max_queue,
+            'queue_depth': stats['requests_queued'],
+            **{key: stats[key] for key in ('requests_active', 'requests_total', 'requests_failed',
+                                           'requests_rejected', 'pages_rendered', 'pages_in_flight')},
+            'avg_seconds': round(stats['seconds_total'] / finished, 3) if finished > 0 else None,
+            'avg_first_page_seconds':
+                round(stats['first_page_seconds_total'] / with_pages, 3) if with_pages else None,
+        }
+
+    def profiles(self):
+        return {
+            'profiles': [os.path.splitext(name)[0] for name in self.backgrounds],
+            'users': list_users(),
+            'fonts': self.fonts,
+            'formats': sorted(OUTPUT_FORMATS),
+        }
+
+    def request_params(self, request):
+        """由请求得到渲染参数：背景配置叠加用户配置，再叠加请求中的参数"""
+        if not isinstance(request, dict) or not isinstance(request.get('text'), str):
+            raise RequestError(400, "请求体应为 JSON 对象，并包含字符串 text")
+        if not self.backgrounds or not self.fonts:
+            raise RequestError(500, "没有可用的背景或字体")
+        names = {os.path.splitext(name)[0]: name for name in self.backgrounds}
+        profile = request.get('profile') or os.path.splitext(self.backgrounds[0])[0]
+        if profile not in names:
+            raise RequestError(400, f"没有这个配置: {profile}")
+        font = request.get('font') or self.fonts[0]
+        if font not in self.fonts:
+            raise RequestError(400, f"没有这个字体: {font}")
+        user = request.get('user')
+        # 只接受 Parameter/Users/ 下已有的用户配置名，不能借它读取其他路径的文件
+        if user and user not in list_users():
+            raise RequestError(400, f"没有这个用户配置: {user}")
+        background_path = os.path.join(BACKGROUND_DIR, names[profile])
+        try:
+            params = load_profile(background_path, user)
+            params.update(request.get('params') or {})
+            params.update(font_path=os.path.join(FONTS_DIR, font), background_path=background_path,
+                          output_format=request.get('format') or params.get('output_format', 'png'))
+            params = validate_params(params, '请求参数')
+            compile_layout(params, background_cache.page_size(background_path))
+        except (ProfileError, TypeError, ValueError) as e:
+            raise RequestError(400, str(e))
+        return params
+
+    async def handle(self, reader, writer):
+        """处理一个连接（一个请求，响应后关闭连接）"""
+        try:
+            try:
+                method, path, body = await self.read_request(reader)
+                if path == '/render':
+                    if method != 'POST':
+                        raise RequestError(405, "请使用 POST")
+                    await self.render(writer, body)
+                elif path == '/metrics':
+                    await send_json(writer, 200, self.metrics())
+                elif path == '/profiles':
+                    await send_json(writer, 200, self.profiles())
+                else:
+                    raise RequestError(404, f"没有这个接口: {path}")
+            except RequestError as e:
+                await send_json(writer, e.status, {'error': str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # 客户端提前断开
+            pass
+        except Exception as e:
+            # 响应已经开始发送，只能断开连接
+            print(f"渲染请求失败: {e!r}", file=sys.stderr)
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise RequestError(400, "无效的请求行")
+        method, target, _ = request_line
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY:
+            raise RequestError(413, "请求体过大")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), urlsplit(target).path, body
+
+    async def render(self, writer, body):
+        start = time.perf_counter()
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise RequestError(400, "请求体不是有效的 JSON")
+        params = self.request_params(request)
+        stats = self.stats
+        if stats['requests_queued'] >= self.max_queue:
+            stats['requests_rejected'] += 1
+            raise RequestError(503, "排队的请求过多，请稍后再试")
+
+        stats['requests_total'] += 1
+        stats['requests_queued'] += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            stats['requests_queued'] -= 1
+        stats['requests_active'] += 1
+        try:
+            await self.stream_pages(writer, request['text'].split('\n'), params, start)
+        except BaseException:
+            stats['requests_failed'] += 1
+            raise
+        finally:
+            stats['requests_active'] -= 1
+            stats['seconds_total'] += time.perf_counter() - start
+            self.slots.release()
+
+    def submit(self, page, params):
+        """把一页交给渲染进程，返回 asyncio future"""
+        pool_future = self.pool.submit(render_encoded, page, params)
+        future = asyncio.wrap_future(pool_future)
+        self.stats['pages_in_flight'] += 1
+
+        def finished(_):
+            self.stats['pages_in_flight'] -= 1
+            if future.cancelled():
+                # 请求中途放弃：已经开始渲染的页完成后释放其共享内存
+                pool_future.add_done_callback(release_result)
+        future.add_done_callback(finished)
+        return future
+
+    async def stream_pages(self, writer, paragraphs, params, start):
+        """排版后把各页交给渲染进程，按页码顺序发回"""
+        loop = asyncio.get_running_loop()
+        page_size = background_cache.page_size(params['background_path'])
+        try:
+            pages = await loop.run_in_executor(None, layout_document, paragraphs, params, page_size)
+        except Exception as e:
+            raise RequestError(500, f"排版失败: {e}")
+        fmt = output_format(params)
+        multipage = is_multipage(params)
+        if not multipage:
+            await send_head(writer, 200, {
+                'Content-Type': f'multipart/mixed; boundary={MULTIPART_BOUNDARY}',
+                'Transfer-Encoding': 'chunked',
+                'X-Page-Count': str(len(pages)),
+            })
+
+        images = []
+        pending = deque()
+        try:
+            for page in pages:
+                pending.append((page.number, self.submit(page, params)))
+                # 每个请求同时在途的页数有限，多个请求公平地分享进程池
+                if len(pending) >= self.workers:
+                    await self.emit(writer, *pending.popleft(), fmt, images, start)
+            while pending:
+                await self.emit(writer, *pending.popleft(), fmt, images, start)
+        finally:
+            for _, future in pending:
+                if not future.cancel():
+                    release_result(future)
+
+        if multipage:
+            data = await loop.run_in_executor(None, encode_document, images, params)
+            await send_head(writer, 200, {
+                'Content-Type': MIME_TYPES[fmt],
+                'Content-Length': str(len(data)),
+                'Content-Disposition': f'attachment; filename="pages{OUTPUT_FORMATS[fmt][1]}"',
+                'X-Page-Count': str(len(pages)),
+            })
+            writer.write(data)
+        else:
+            await send_chunk(writer, f'--{MULTIPART_BOUNDARY}--\r\n'.encode('ascii'))
+            await send_chunk(writer, b'')
+        await writer.drain()
+
+    async def emit(self, writer, number, future, fmt, images, start):
+        """等一页渲染完成后发出（多页格式先留着，最后合成一个文件）"""
+        result = await future
+        if number == 1:
+            self.stats['requests_with_pages'] += 1
+            self.stats['first_page_seconds_total'] += time.perf_counter() - start
+        self.stats['pages_rendered'] += 1
+        if isinstance(result, bytes):
+            part = (f'--{MULTIPART_BOUNDARY}\r\n'
+                    f'Content-Type: {MIME_TYPES[fmt]}\r\n'
+                    f'Content-Disposition: attachment; filename="page_{number:03d}{OUTPUT_FORMATS[fmt][1]}"\r\n'
+                    f'X-Page: {number}\r\n'
+                    f'Content-Length: {len(result)}\r\n\r\n').encode('ascii')
+            await send_chunk(writer, part + result + b'\r\n')
+        else:
+            # 多页格式的页留在共享内存中，这里解码后立即释放
+            images.append(result.to_image())
+            result.release()
+
+
+async def send_head(writer, status, headers):
+    lines = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}', 'Connection: close']
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    await writer.drain()
+
+
+async def send_chunk(writer, data):
+    """发送一个 chunked 编码的数据块，空数据块表示结束"""
+    writer.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+    await writer.drain()
+
+
+async def send_json(writer, status, data):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    await send_head(writer, status, {'Content-Type': 'application/json; charset=utf-8',
+                                     'Content-Length': str(len(body))})
+    writer.write(body)
+    await writer.drain()
+
+
+async def serve(args):
+    service = RenderService(args.workers, args.max_requests, args.max_queue)
+    print("正在预热渲染进程...", file=sys.stderr)
+    await service.start()
+    if args.unix:
+        server = await asyncio.start_unix_server(service.handle, path=args.unix)
+        address = args.unix
+    else:
+        server = await asyncio.start_server(service.handle, args.host, args.port)
+        address = f"http://{args.host}:{args.port}"
+    print(f"渲染服务已启动: {address}（{service.workers} 个渲染进程）", file=sys.stderr)
+    try:
+        # 收到 SIGTERM 时停止服务并结束渲染进程（Windows 上没有此信号处理）
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    except (NotImplementedError, AttributeError):
+        pass
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        service.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m service', description='本地手写渲染服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--unix', default=None, help='改为监听 Unix socket 路径')
+    parser.add_argument('--workers', type=int, default=None, help='常驻渲染进程数，默认为 CPU 核数')
+    parser.add_argument('--max-requests', type=int, default=4, help='同时处理的请求数')
+    parser.add_argument('--max-queue', type=int, default=32, help='排队请求数上限，超出时返回 503')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""断点续转 (manifest.Checkpoint / DocumentConverter 的 resume) 的测试
+
+在第 k 页写完后中断，再以 resume 继续，输出应与一次转换完的结果逐字节相同；
+参数、输入有变化或断点之前的页缺失时不能继续，从头转换
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from layout import layout_cache
+from manifest import CHECKPOINT_NAME, Checkpoint
+from pipeline import DocumentConverter, output_dir_for, preview_params
+from profiles import DEFAULT_PARAMS
+from reader import read_text_from_file, source_key
+from render import background_cache
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT_PATH = os.path.join(BASE_DIR, 'fonts', '义启手写体.ttf')
+PARAGRAPHS = ['断点续转：中断后从最后写完的页继续，输出与一次转换完的结果相同。' * 3,
+              'Resuming must reproduce the same pages, byte for byte.',
+              '字号抖动的随机流状态也记在断点中，继续时从同一位置取字号。' * 4]
+INTERRUPT_AFTER = 2
+
+
+def output_files(output_base):
+    """输出目录中每页文件内容的哈希（比较失败时不必对整个文件求差异）"""
+    pages = {}
+    for name in sorted(os.listdir(output_base)):
+        if name.endswith('.png'):
+            with open(os.path.join(output_base, name), 'rb') as f:
+                pages[name] = hashlib.sha1(f.read()).hexdigest()
+    return pages
+
+
+class CheckpointTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.assets_dir = tempfile.mkdtemp(prefix='checkpoint_assets_')
+        background_path = os.path.join(cls.assets_dir, 'background.png')
+        pixels = np.random.default_rng(2).integers(200, 256, (190, 160, 3), dtype=np.uint8)
+        Image.fromarray(pixels, 'RGB').save(background_path)
+        # 分条渲染时每页在转换线程中同步写完，中断的位置是确定的
+        cls.params = dict(DEFAULT_PARAMS, font_path=FONT_PATH, background_path=background_path,
+                          font_size=16, font_size_sigma=2, line_spacing=24, left_margin=10, right_margin=10,
+                          top_margin=10, bottom_margin=10, output_format='png', band_height=64, workers=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        background_cache.clear()
+        shutil.rmtree(cls.assets_dir, ignore_errors=True)
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='checkpoint_')
+        self.input_file = os.path.join(self.work_dir, 'input.txt')
+        with open(self.input_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(PARAGRAPHS))
+
+    def tearDown(self):
+        layout_cache.clear()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def convert(self, output_dir, params, interrupt_after=None):
+        """转换一次；给出 interrupt_after 时在该页写完后取消"""
+        def events(event):
+            if event['event'] == 'page' and event['number'] == interrupt_after:
+                converter.stop()
+
+        converter = DocumentConverter(self.input_file, os.path.join(self.work_dir, output_dir),
+                                      dict(params, resume=True), events=events)
+        return converter.run()
+
+    def interrupt(self, params=None):
+        """在第 INTERRUPT_AFTER 页写完后中断，返回输出目录和断点记录"""
+        with self.assertRaises(InterruptedError):
+            self.convert('resumed', params or self.params, INTERRUPT_AFTER)
+        output_base = output_dir_for(self.input_file, os.path.join(self.work_dir, 'resumed'))
+        checkpoint = Checkpoint(output_base)
+        self.assertEqual(checkpoint.record['page'], INTERRUPT_AFTER)
+        return output_base, checkpoint
+
+    def uninterrupted(self, seed):
+        """同一随机种子一次转换完的输出"""
+        result = self.convert('clean', dict(self.params, seed=seed))
+        self.assertIsNone(result['resumed_from'])
+        return output_files(result['output_dir'])
+
+    def test_resume_matches_uninterrupted(self):
+        output_base, checkpoint = self.interrupt()
+        self.assertIsNotNone(checkpoint.record['offset'])
+        # 没有指定种子时沿用断点记录的种子
+        result = self.convert('resumed', self.params)
+        self.assertEqual(result['resumed_from'], INTERRUPT_AFTER)
+        self.assertFalse(os.path.exists(os.path.join(output_base, CHECKPOINT_NAME)))
+
+        expected = self.uninterrupted(checkpoint.seed)
+        self.assertGreater(len(expected), INTERRUPT_AFTER + 1)
+        self.assertEqual(result['pages'], len(expected))
+        self.assertEqual(output_files(output_base), expected)
+
+    def test_resume_after_preview(self):
+        # 重启程序（排版缓存为空）后先预览再转换：预览按断点取种子，转换使用预览的排版并从断点继续
+        output_base, checkpoint = self.interrupt()
+        layout_cache.clear()
+        params = dict(self.params, resume=True)
+        preview = preview_params(self.input_file, os.path.join(self.work_dir, 'resumed'), params)
+        self.assertEqual(preview['seed'], checkpoint.seed)
+        layout_cache.get(read_text_from_file(self.input_file), preview,
+                         background_cache.page_size(self.params['background_path']),
+                         source=source_key(self.input_file))
+        result = self.convert('resumed', self.params)
+        self.assertEqual(result['resumed_from'], INTERRUPT_AFTER)
+        self.assertEqual(output_files(output_base), self.uninterrupted(checkpoint.seed))
+
+    def test_changed_params_restarts(self):
+        self.interrupt(dict(self.params, seed=11))
+        result = self.convert('resumed', dict(self.params, seed=11, word_spacing=self.params['word_spacing'] + 2))
+        self.assertIsNone(result['resumed_from'])
+
+    def test_changed_input_restarts(self):
+        output_base, _ = self.interrupt()
+        with open(self.input_file, 'a', encoding='utf-8') as f:
+            f.write('\n追加的段落。')
+        result = self.convert('resumed', self.params)
+        self.assertIsNone(result['resumed_from'])
+        self.assertEqual(result['pages'], len(output_files(output_base)))
+
+    def test_missing_page_restarts(self):
+        output_base, checkpoint = self.interrupt()
+        os.remove(os.path.join(output_base, 'page_001.png'))
+        result = self.convert('resumed', self.params)
+        self.assertIsNone(result['resumed_from'])
+        self.assertEqual(output_files(output_base), self.uninterrupted(checkpoint.seed))
+
+
+if __name__ == '__main__':
+    unittest.main()
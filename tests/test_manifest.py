@@ -0,0 +1,92 @@
+"""输出清单 (manifest.RenderManifest) 的测试：重新转换时只重写有变化的页
+
+按界面的流程：预览（pipeline.preview_params + layout_cache）、转换、修改文本、再预览、再转换
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from layout import layout_cache
+from pipeline import DocumentConverter, preview_params
+from profiles import DEFAULT_PARAMS
+from reader import read_text_from_file, source_key
+from render import background_cache
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT_PATH = os.path.join(BASE_DIR, 'fonts', '义启手写体.ttf')
+PARAGRAPHS = ['重新转换时只重写有变化的页，其余的页沿用上次的输出。' * 3,
+              'Unchanged pages keep their files and are skipped on reconversion.',
+              '修改最后一段只影响最后一页，前面的页应当全部跳过。' * 3,
+              '最后一段。']
+
+
+class ReconvertTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.assets_dir = tempfile.mkdtemp(prefix='manifest_assets_')
+        background_path = os.path.join(cls.assets_dir, 'background.png')
+        pixels = np.random.default_rng(4).integers(200, 256, (190, 160, 3), dtype=np.uint8)
+        Image.fromarray(pixels, 'RGB').save(background_path)
+        # 与界面相同：参数中没有随机种子，开启字号抖动
+        cls.params = dict(DEFAULT_PARAMS, font_path=FONT_PATH, background_path=background_path,
+                          font_size=16, font_size_sigma=2, line_spacing=24, left_margin=10, right_margin=10,
+                          top_margin=10, bottom_margin=10, output_format='png', workers=1, seed=None,
+                          resume=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        background_cache.clear()
+        shutil.rmtree(cls.assets_dir, ignore_errors=True)
+
+    def setUp(self):
+        layout_cache.clear()
+        self.work_dir = tempfile.mkdtemp(prefix='manifest_')
+        self.output_dir = os.path.join(self.work_dir, 'output')
+        self.input_file = os.path.join(self.work_dir, 'input.txt')
+        self.write_input(PARAGRAPHS)
+
+    def tearDown(self):
+        layout_cache.clear()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def write_input(self, paragraphs):
+        with open(self.input_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(paragraphs))
+
+    def preview(self):
+        """与界面的预览线程相同：取种子、排版并缓存，返回排好的页"""
+        params = preview_params(self.input_file, self.output_dir, self.params)
+        page_size = background_cache.page_size(params['background_path'])
+        return layout_cache.get(read_text_from_file(self.input_file), params, page_size,
+                                source=source_key(self.input_file))
+
+    def convert(self, **params):
+        return DocumentConverter(self.input_file, self.output_dir, dict(self.params, **params)).run()
+
+    def test_preview_edit_reconvert(self):
+        pages = self.preview()
+        self.assertGreater(len(pages), 3)
+        first = self.convert()
+        self.assertEqual((first['pages'], first['pages_skipped']), (len(pages), 0))
+
+        # 只修改最后一段，新的会话中重新预览
+        layout_cache.clear()
+        self.write_input(PARAGRAPHS[:-1] + ['最后一段，改过了。'])
+        edited = self.preview()
+        self.assertEqual(edited[0].seed, pages[0].seed)
+        second = self.convert()
+        self.assertEqual(second['pages'], len(edited))
+        self.assertEqual(second['pages_skipped'], len(edited) - 1)
+
+    def test_seed_option_then_seedless(self):
+        first = self.convert(seed=5)
+        self.assertEqual(first['pages_skipped'], 0)
+        # 没有指定种子时沿用清单中的种子 5，结果与指定 --seed 5 相同
+        second = self.convert()
+        self.assertEqual(second['pages_skipped'], first['pages'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""分条写 PNG (page_writer.write_png_bands) 的往返测试：用 Pillow 解码后与整页渲染逐像素比较"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+from layout import layout_document
+from page_writer import write_png_bands
+from profiles import DEFAULT_PARAMS
+from render import background_cache, render_and_save, render_page
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT_PATH = os.path.join(BASE_DIR, 'fonts', '义启手写体.ttf')
+TEXT = '分条渲染的页面应当与整页渲染逐像素一致。Banded pages must match whole pages.' * 4
+
+
+def bands_of(image, height):
+    """把图像切成高 height 的横条（最后一条可能较矮）"""
+    return [image.crop((0, top, image.width, min(top + height, image.height)))
+            for top in range(0, image.height, height)]
+
+
+class WritePngBandsTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='png_bands_')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def assert_round_trip(self, image, height, compress_level=6):
+        path = os.path.join(self.work_dir, f'band_{height}.png')
+        stats = write_png_bands(path, image.size, bands_of(image, height), {'png_compress_level': compress_level})
+        self.assertEqual(stats['bytes'], os.path.getsize(path))
+        with Image.open(path) as decoded:
+            decoded.load()
+            self.assertEqual((decoded.mode, decoded.size), ('RGB', image.size))
+            self.assertEqual(decoded.tobytes(), image.tobytes())
+
+    def test_random_pixels(self):
+        # 奇数宽度：每行 3 * 宽 字节，不按 4 字节对齐
+        pixels = np.random.default_rng(0).integers(0, 256, (23, 37, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels, 'RGB')
+        for height in (1, 5, 22, 23, 64):
+            with self.subTest(band_height=height):
+                self.assert_round_trip(image, height)
+
+    def test_compress_levels(self):
+        image = Image.new('RGB', (16, 9), (200, 10, 30))
+        for level in (0, 1, 9):
+            with self.subTest(compress_level=level):
+                self.assert_round_trip(image, 4, level)
+
+
+class RenderBandsTest(unittest.TestCase):
+    """render_and_save 分条写出的页面与 render_page 整页渲染的结果相同（含跨条的字形）"""
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp(prefix='render_bands_')
+        cls.background_path = os.path.join(cls.work_dir, 'background.png')
+        pixels = np.random.default_rng(1).integers(180, 256, (157, 211, 3), dtype=np.uint8)
+        Image.fromarray(pixels, 'RGB').save(cls.background_path)
+        cls.params = dict(DEFAULT_PARAMS, font_path=FONT_PATH, background_path=cls.background_path,
+                          font_size=18, line_spacing=26, left_margin=12, right_margin=12, top_margin=10,
+                          bottom_margin=10, seed=3, output_format='png')
+        pages = layout_document([TEXT], cls.params, background_cache.page_size(cls.background_path))
+        cls.page = pages[0]
+        cls.expected = render_page(cls.page, cls.params).tobytes()
+
+    @classmethod
+    def tearDownClass(cls):
+        background_cache.clear()
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    def test_band_heights(self):
+        with Image.open(self.background_path) as background:
+            self.assertNotEqual(background.convert('RGB').tobytes(), self.expected)  # 页面上有字
+        # 157 行：1 行一条、不能整除的条高、比整页还高的条
+        for height in (1, 7, 40, 156, 500):
+            with self.subTest(band_height=height):
+                path = os.path.join(self.work_dir, f'page_{height}.png')
+                render_and_save(self.page, dict(self.params, band_height=height), path)
+                with Image.open(path) as decoded:
+                    self.assertEqual(decoded.convert('RGB').tobytes(), self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
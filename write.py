@@ -1,15 +1,23 @@
-from PIL import Image, ImageDraw, ImageFont
-import docx2txt
-import textwrap
+import time
+STARTUP_TIME = time.perf_counter()  # 启动计时的起点（不含解释器自身的启动）
 import os
-import random
+import sys
 import json
+import threading
+from collections import OrderedDict
 from pathlib import Path
+# 只导入轻量的模块；numpy、Pillow、排版和渲染在后台线程第一次用到时才导入
+from jobs import JobQueue, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from profiles import (DEFAULT_PARAMS, DEFAULT_PROFILE, ProfileError, background_profile, list_users,
+                      load_profile, user_profile, variant_params)
+from reader import SUPPORTED_EXTS, collect_inputs, read_text_from_file, source_key
+from page_writer import OUTPUT_FORMATS
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel,
                             QFileDialog, QVBoxLayout, QHBoxLayout, QWidget, 
                             QProgressBar, QMessageBox, QLineEdit, QSpinBox,
-                            QComboBox, QDoubleSpinBox, QGridLayout)  
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+                            QComboBox, QDoubleSpinBox, QGridLayout, QTableWidget,
+                            QTableWidgetItem, QHeaderView, QAbstractItemView, QCheckBox)  
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QPixmap, QImage, QDragEnterEvent, QDropEvent
 
 class StyleSheet:
@@ -164,186 +172,204 @@ class PreviewWidget(QLabel):
         self.setStyleSheet(StyleSheet.PREVIEW_LABEL)
         self.setAcceptDrops(True)
   
-    def update_preview(self, background_path, font_path, params):
-        """更新预览图像"""
-        try:
-            # 创建预览图像
-            background = Image.open(background_path)
-            # 调整预览图像大小
-            preview_width = 400
-            ratio = preview_width / background.width
-            preview_height = int(background.height * ratio)
-            background = background.resize((preview_width, preview_height))
-            
-            draw = ImageDraw.Draw(background)
-            font = ImageFont.truetype(font_path, int(params['font_size'] * ratio))
-            
-            # 使用参数中的预览文本
-            preview_text = params.get('preview_text', "预览文本\n第二行文本")
-            
-            # 绘制文本
-            x = params['left_margin'] * ratio
-            y = params['top_margin'] * ratio
-            
-            # 添加随机扰动
-            x += random.gauss(0, params['perturb_x_sigma'] * ratio)
-            y += random.gauss(0, params['perturb_y_sigma'] * ratio)
-            
-            draw.text((x, y), preview_text, font=font, fill=(0, 0, 0))
-            
-            # 转换为QPixmap并显示
-            img = background.convert('RGB')
-            data = img.tobytes("raw", "RGB")
-            qimg = QImage(data, img.width, img.height, QImage.Format.Format_RGB888)
-            pixmap = QPixmap.fromImage(qimg)
-            self.setPixmap(pixmap)
-        except Exception as e:
-            self.setText(f"预览失败: {str(e)}")
+    def show_image(self, page):
+        """显示渲染好的预览页（PageBuffer）
+
+        QImage 直接引用缓冲区的像素并给出行宽，不复制；只在转换为 QPixmap 时复制一次
+        """
+        qimage = QImage(page.buf, page.width, page.height, page.stride, QImage.Format.Format_RGB888)
+        self.setPixmap(QPixmap.fromImage(qimage))
 
     def dragEnterEvent(self, event: QDragEnterEvent):
         if event.mimeData().hasUrls():
             event.acceptProposedAction()
 
     def dropEvent(self, event: QDropEvent):
-        files = [u.toLocalFile() for u in event.mimeData().urls()]
-        if files:
-            file_path = files[0]
-            if file_path.lower().endswith(('.txt', '.doc', '.docx')):
-                self.parent().parent().input_path.setText(file_path)
-                self.parent().parent().update_preview()
-            else:
-                QMessageBox.warning(self, "错误", "不支持的文件格式！")
+        # 可以一次拖入多个文件或文件夹，全部加入转换队列
+        paths = [u.toLocalFile() for u in event.mimeData().urls()]
+        if paths:
+            self.window().add_input_files(paths)
+
+def render_preview_image(page, params, preview_width=400):
+    """按比例缩小绘制一页预览，返回 PageBuffer，可在后台线程调用"""
+    from page_buffer import PageBuffer
+    from render import background_cache, draw_glyphs, page_glyphs
+
+    # 调整预览图像大小（复用缓存中缩放好的背景）
+    background_path = params['background_path']
+    width, height = background_cache.page_size(background_path)
+    ratio = preview_width / width
+    preview_height = int(height * ratio)
+    background = background_cache.new_page(background_path, (preview_width, preview_height))
+    
+    # 与正式转换使用同一份排版和扰动，只按比例缩小
+    font_size = max(1, int(params['font_size'] * ratio))
+    draw_glyphs(background, page_glyphs(page, params, font_size, ratio), params)
+    
+    # 背景已是 RGB，只复制一次到按行对齐的缓冲区，界面线程直接用它构造 QImage
+    return PageBuffer.from_image(background)
 
-class HandwritingConverter(QThread):
-    """后台转换线程"""
-    progress = pyqtSignal(int, str)  # 进度值和进度信息
-    finished = pyqtSignal(bool, str)
+class PreviewWorker(QThread):
+    """后台预览线程：新请求覆盖未处理的旧请求，只渲染可见页，再预热相邻页"""
+    rendered = pyqtSignal(int, int, int, object)  # 请求编号、页码、总页数、PageBuffer
+    missing = pyqtSignal(int, str)  # 请求编号、字体缺少的字符
+    failed = pyqtSignal(int, str)
 
-    def __init__(self, input_file, output_dir, params):
+    def __init__(self):
         super().__init__()
-        self.input_file = input_file
-        self.output_dir = output_dir
-        self.params = params
-        self.is_running = True
+        self._condition = threading.Condition()
+        self._request = None
+        self._running = True
+        self._text_key = None
+        self._text = None
+        self._missing_key = None
+        self._missing = ''
+
+    def request(self, generation, file_path, params, page_index, cached_pages=(), output_dir=None):
+        """提交预览请求；cached_pages 为界面已缓存、无需重新渲染的页，output_dir 为转换的输出目录"""
+        with self._condition:
+            self._request = (generation, file_path, params, page_index, set(cached_pages), output_dir)
+            self._condition.notify()
+
+    def stop(self):
+        """停止预览线程"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def has_pending(self):
+        return self._request is not None or not self._running
 
     def run(self):
-        try:
-            # 读取文本内容
-            self.progress.emit(10, "正在读取文件...")
-            text_content = self.read_text_from_file(self.input_file)
-            
-            # 分割文本为段落
-            paragraphs = text_content.split('\n')
-            total_paragraphs = len(paragraphs)
-            
-            # 创建输出目录
-            output_base = os.path.join(
-                self.output_dir,
-                f"handwritten_{os.path.splitext(os.path.basename(self.input_file))[0]}"
-            )
-            os.makedirs(output_base, exist_ok=True)
-            
-            # 开始转换
-            self.progress.emit(20, "正在转换...")
-            current_page = 1
-            current_y = self.params['top_margin']
-            current_text = []
-            
-            background = Image.open(self.params['background_path'])
-            draw = ImageDraw.Draw(background)
-            font = ImageFont.truetype(self.params['font_path'], self.params['font_size'])
-            
-            for i, paragraph in enumerate(paragraphs):
-                if not self.is_running:
-                    raise InterruptedError("转换已取消")
-                
-                # 处理段落文本换行
-                max_width = background.width - self.params['left_margin'] - self.params['right_margin']
-                wrapped_lines = textwrap.wrap(paragraph, width=int(max_width / (self.params['font_size'] * 0.5)))
-                
-                for line in wrapped_lines:
-                    # 检查是否需要新页
-                    if current_y + self.params['font_size'] > background.height - self.params['bottom_margin']:
-                        # 保存当前页
-                        output_path = os.path.join(output_base, f"page_{current_page:03d}.png")
-                        background.save(output_path)
-                        current_page += 1
-                        
-                        # 创建新页
-                        background = Image.open(self.params['background_path'])
-                        draw = ImageDraw.Draw(background)
-                        current_y = self.params['top_margin']
-                    
-                    # 写入当前行
-                    x = self.params['left_margin']
-                    for char in line:
-                        # 添加随机扰动
-                        dx = random.gauss(0, self.params['perturb_x_sigma'])
-                        dy = random.gauss(0, self.params['perturb_y_sigma'])
-                        theta = random.gauss(0, self.params['perturb_theta_sigma'])
-                        
-                        # 绘制字符
-                        draw.text(
-                            (x + dx, current_y + dy),
-                            char,
-                            font=font,
-                            fill=(0, 0, 0)
-                        )
-                        
-                        # 计算字符宽度并添加随机间距
-                        char_width = draw.textlength(char, font=font)
-                        x += char_width + self.params['word_spacing'] + random.gauss(0, self.params['word_spacing_sigma'])
-                    
-                    current_y += self.params['line_spacing'] + random.gauss(0, self.params['line_spacing_sigma'])
-                
-                # 段落间距
-                if i < len(paragraphs) - 1:
-                    current_y += self.params['line_spacing'] * 1.5
-                
-                # 更新进度
-                progress = int(20 + (i / total_paragraphs) * 70)
-                self.progress.emit(progress, f"正在处理第 {current_page} 页...")
-            
-            # 保存最后一页
-            output_path = os.path.join(output_base, f"page_{current_page:03d}.png")
-            background.save(output_path)
-            
-            self.progress.emit(100, "转换完成！")
-            self.finished.emit(True, f"转换完成！共生成 {current_page} 页")
-            
-        except InterruptedError as e:
-            self.finished.emit(False, str(e))
-        except Exception as e:
-            self.finished.emit(False, f"错误: {str(e)}")
+        while True:
+            with self._condition:
+                while self._request is None and self._running:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                request, self._request = self._request, None
+            try:
+                self.process(*request)
+            except Exception as e:
+                self.failed.emit(request[0], str(e))
 
-    def read_text_from_file(self, file_path):
-        """读取文件内容"""
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"找不到文件: {file_path}")
-            
-        file_ext = os.path.splitext(file_path)[1].lower()
+    def process(self, generation, file_path, params, page_index, cached_pages, output_dir):
+        from layout import layout_cache
+        from pipeline import preview_params
+        from render import background_cache
+
+        # 与转换取同样的随机种子，转换时直接使用这份排版
+        params = preview_params(file_path, output_dir, params)
+        text = self.read_text(file_path)
+        page_size = background_cache.page_size(params['background_path'])
+        pages = layout_cache.get(text, params, page_size, is_running=lambda: not self.has_pending(),
+                                 source=source_key(file_path) if file_path else None)
+        page_index = min(page_index, len(pages) - 1)
+        self.missing.emit(generation, self.missing_chars(text, params['font_path']))
         
-        if file_ext == '.txt':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        elif file_ext in ['.docx', '.doc']:
-            return docx2txt.process(file_path)
-        else:
-            raise ValueError(f"不支持的文件格式: {file_ext}")
+        # 先渲染可见页，再预热前后页；有新请求时立即放弃
+        for index in (page_index, page_index + 1, page_index - 1):
+            if index < 0 or index >= len(pages) or index in cached_pages:
+                continue
+            if self.has_pending():
+                return
+            self.rendered.emit(generation, index, len(pages), render_preview_image(pages[index], params))
 
-    def stop(self):
-        """停止转换"""
-        self.is_running = False
+    def missing_chars(self, text, font_path):
+        """文本中字体缺少的字符，文本和字体未变化时复用上次的结果"""
+        from font_registry import font_registry
+
+        key = (self._text_key, font_path)
+        if key != self._missing_key:
+            self._missing = ''.join(sorted(font_registry.missing_chars(font_path, text)))
+            self._missing_key = key
+        return self._missing
+
+    def read_text(self, file_path):
+        """读取预览文本，文件未变化时复用上次的解析结果"""
+        if not file_path:
+            return "预览文本\n第二行文本"
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_mtime, stat.st_size)
+        if key != self._text_key:
+            self._text = read_text_from_file(file_path)
+            self._text_key = key
+        return self._text
+
+def scan_assets():
+    """创建必要的目录，扫描字体、背景和用户配置，读取第一个背景的参数配置；在后台线程调用"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    assets = {'error': None, 'params': None}
+    for folder in ("fonts", "Background", "Parameter"):
+        os.makedirs(os.path.join(current_dir, folder), exist_ok=True)
+
+    fonts_dir = os.path.join(current_dir, "fonts")
+    assets['fonts'] = [(name, os.path.join(fonts_dir, name))
+                       for name in os.listdir(fonts_dir) if name.lower().endswith('.ttf')]
+    bg_dir = os.path.join(current_dir, "Background")
+    assets['backgrounds'] = [(name, os.path.join(bg_dir, name))
+                             for name in os.listdir(bg_dir) if name.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    assets['users'] = list_users()
+
+    try:
+        if not os.path.exists(DEFAULT_PROFILE):
+            # 创建默认参数文件
+            with open(DEFAULT_PROFILE, 'w', encoding='utf-8') as f:
+                json.dump(DEFAULT_PARAMS, f, indent=4, ensure_ascii=False)
+        # 启动时选中第一个背景，叠加它的参数配置
+        assets['params'] = load_profile(assets['backgrounds'][0][1] if assets['backgrounds'] else None)
+    except Exception as e:
+        assets['error'] = f"加载默认参数失败: {str(e)}"
+
+    # 预读字体的覆盖范围和度量（同样在后台），预览和转换时直接使用
+    from font_registry import font_registry
+    font_registry.preload([path for _, path in assets['fonts']])
+    return assets
+
+class AssetScanner(QThread):
+    """窗口显示后在后台扫描资源目录，完成后发出 scanned"""
+    scanned = pyqtSignal(dict)
+
+    def run(self):
+        self.scanned.emit(scan_assets())
+
+# 任务状态在队列表格中的显示
+JOB_STATUS_TEXT = {
+    QUEUED: '等待中',
+    RUNNING: '转换中',
+    DONE: '完成',
+    FAILED: '失败',
+    CANCELLED: '已取消',
+}
 
 class MainWindow(QMainWindow):
+    job_changed = pyqtSignal(int)  # 任务编号，由队列线程发出
+
     def __init__(self):
         super().__init__()
-        self.converter = None
-        self.preview_pages = []  # 存储预览页面的内容
+        self.batch_job_ids = []  # 最近一次开始转换提交的任务
+        self.batch_active = False  # 这批任务是否还未全部结束
+        self.job_queue = JobQueue(max_jobs=2, listener=lambda job: self.job_changed.emit(job.id))
+        self.job_changed.connect(self.update_job)
+        self.seed = None  # 随机种子，来自参数配置，固定后可复现同样的效果
+        self.profile_params = {}  # 最近一次载入配置后的界面参数，关闭时只保存此后的修改
+        self.preview_page_count = 0  # 预览总页数
         self.current_preview_page = 0  # 当前预览页码
+        self.preview_generation = 0  # 预览请求编号，参数变化时递增
+        self.preview_request = None
+        self.preview_images = OrderedDict()  # 当前请求已渲染的页 (LRU)
+        self.missing_chars = ''  # 当前文本中字体缺少的字符
+        self.preview_worker = PreviewWorker()
+        self.preview_worker.rendered.connect(self.preview_rendered)
+        self.preview_worker.missing.connect(self.preview_missing)
+        self.preview_worker.failed.connect(self.preview_failed)
+        self.preview_worker.start()
+        # 启动各阶段的耗时；资源扫描和第一次预览在窗口显示后于后台进行
+        self.startup_times = {'导入模块': time.perf_counter() - STARTUP_TIME}
+        self.asset_scanner = AssetScanner()
+        self.asset_scanner.scanned.connect(self.assets_scanned)
         self.initUI()
-        self.create_required_directories()
-        self.load_default_params()
+        self.mark_startup('创建窗口')
 
     def initUI(self):
         """初始化UI"""
@@ -376,6 +402,39 @@ class MainWindow(QMainWindow):
         file_layout.addWidget(self.select_file_btn)
         control_layout.addLayout(file_layout)
 
+        # 转换队列：可加入多个文件，选中一行即预览该文件
+        self.job_table = QTableWidget(0, 3)
+        self.job_table.setHorizontalHeaderLabels(['文件', '状态', '进度'])
+        self.job_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.job_table.verticalHeader().setVisible(False)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.job_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.job_table.setMaximumHeight(160)
+        self.job_table.currentCellChanged.connect(self.job_row_selected)
+        control_layout.addWidget(self.job_table)
+
+        queue_layout = QHBoxLayout()
+        queue_buttons = [
+            ('添加文件夹', self.select_input_dir),
+            ('上移', lambda: self.move_job_rows(-1)),
+            ('下移', lambda: self.move_job_rows(1)),
+            ('取消', self.cancel_job_rows),
+            ('清除已完成', self.clear_finished_jobs),
+        ]
+        for text, slot in queue_buttons:
+            button = QPushButton(text)
+            button.setStyleSheet(StyleSheet.BUTTON)
+            button.clicked.connect(slot)
+            queue_layout.addWidget(button)
+        queue_layout.addWidget(QLabel('同时转换'))
+        self.jobs_spin = QSpinBox()
+        self.jobs_spin.setRange(1, max(1, os.cpu_count() or 1))
+        self.jobs_spin.setValue(self.job_queue.max_jobs)
+        self.jobs_spin.setStyleSheet(StyleSheet.SPIN_BOX)
+        self.jobs_spin.valueChanged.connect(self.job_queue.set_max_jobs)
+        queue_layout.addWidget(self.jobs_spin)
+        control_layout.addLayout(queue_layout)
+
         # 保存路径
         save_layout = QHBoxLayout()
         self.output_path = QLineEdit()
@@ -399,7 +458,6 @@ class MainWindow(QMainWindow):
         font_bg_layout.addWidget(font_label, 0, 0)  # 第0行，第0列
         self.font_combo = QComboBox()
         self.font_combo.setStyleSheet(StyleSheet.COMBO_BOX)
-        self.load_fonts()
         font_bg_layout.addWidget(self.font_combo, 1, 0)  # 第1行，第0列
         
         # 背景选择
@@ -408,8 +466,20 @@ class MainWindow(QMainWindow):
         font_bg_layout.addWidget(bg_label, 0, 1)  # 第0行，第1列
         self.bg_combo = QComboBox()
         self.bg_combo.setStyleSheet(StyleSheet.COMBO_BOX)
-        self.load_backgrounds()
         font_bg_layout.addWidget(self.bg_combo, 1, 1)  # 第1行，第1列
+        # 在所有背景上各转换一份，每个背景使用自己的参数配置
+        self.all_backgrounds_check = QCheckBox('所有背景各转换一份')
+        self.all_backgrounds_check.setToolTip('输出到以背景命名的子文件夹，每个背景使用 Parameter/<背景名>.json 中的参数')
+        font_bg_layout.addWidget(self.all_backgrounds_check, 2, 1)  # 第2行，第1列
+
+        # 用户配置，叠加在背景配置之上
+        user_label = QLabel('用户配置')
+        user_label.setAlignment(Qt.AlignmentFlag.AlignBottom)
+        font_bg_layout.addWidget(user_label, 0, 2)  # 第0行，第2列
+        self.user_combo = QComboBox()
+        self.user_combo.setStyleSheet(StyleSheet.COMBO_BOX)
+        self.user_combo.addItem('无', None)
+        font_bg_layout.addWidget(self.user_combo, 1, 2)  # 第1行，第2列
         
         # 设置列宽度
         font_bg_layout.setColumnMinimumWidth(0, 150)  # 第一列最小宽度
@@ -437,7 +507,7 @@ class MainWindow(QMainWindow):
         # 上边距
         margins_layout.addWidget(QLabel('上边距'), 0, 0)
         self.top_margin_spin = QSpinBox()
-        self.top_margin_spin.setRange(0, 500)
+        self.top_margin_spin.setRange(0, 1000)
         self.top_margin_spin.setValue(140)
         self.top_margin_spin.setStyleSheet(StyleSheet.SPIN_BOX)
         margins_layout.addWidget(self.top_margin_spin, 0, 1)
@@ -445,7 +515,7 @@ class MainWindow(QMainWindow):
         # 下边距
         margins_layout.addWidget(QLabel('下边距'), 1, 0)
         self.bottom_margin_spin = QSpinBox()
-        self.bottom_margin_spin.setRange(0, 500)
+        self.bottom_margin_spin.setRange(0, 1000)
         self.bottom_margin_spin.setValue(70)
         self.bottom_margin_spin.setStyleSheet(StyleSheet.SPIN_BOX)
         margins_layout.addWidget(self.bottom_margin_spin, 1, 1)
@@ -453,7 +523,7 @@ class MainWindow(QMainWindow):
         # 左边距
         margins_layout.addWidget(QLabel('左边距'), 0, 2)
         self.left_margin_spin = QSpinBox()
-        self.left_margin_spin.setRange(0, 500)
+        self.left_margin_spin.setRange(0, 1000)
         self.left_margin_spin.setValue(100)
         self.left_margin_spin.setStyleSheet(StyleSheet.SPIN_BOX)
         margins_layout.addWidget(self.left_margin_spin, 0, 3)
@@ -461,7 +531,7 @@ class MainWindow(QMainWindow):
         # 右边距
         margins_layout.addWidget(QLabel('右边距'), 1, 2)
         self.right_margin_spin = QSpinBox()
-        self.right_margin_spin.setRange(0, 500)
+        self.right_margin_spin.setRange(0, 1000)
         self.right_margin_spin.setValue(100)
         self.right_margin_spin.setStyleSheet(StyleSheet.SPIN_BOX)
         margins_layout.addWidget(self.right_margin_spin, 1, 3)
@@ -510,7 +580,25 @@ class MainWindow(QMainWindow):
         self.perturb_y_spin.setStyleSheet(StyleSheet.SPIN_BOX)
         perturb_layout.addWidget(self.perturb_y_spin, 0, 3)
         
+        # 字号扰动（量化为几个字号档位）
+        perturb_layout.addWidget(QLabel('字号扰动'), 1, 0)
+        self.font_size_sigma_spin = QDoubleSpinBox()
+        self.font_size_sigma_spin.setRange(0, 20)
+        self.font_size_sigma_spin.setValue(0)
+        self.font_size_sigma_spin.setStyleSheet(StyleSheet.SPIN_BOX)
+        perturb_layout.addWidget(self.font_size_sigma_spin, 1, 1)
+        
         params_layout.addLayout(perturb_layout)
+
+        # 输出格式
+        output_format_layout = QHBoxLayout()
+        output_format_layout.addWidget(QLabel('输出格式'))
+        self.format_combo = QComboBox()
+        self.format_combo.setStyleSheet(StyleSheet.COMBO_BOX)
+        for fmt in OUTPUT_FORMATS:
+            self.format_combo.addItem(fmt.upper(), fmt)
+        output_format_layout.addWidget(self.format_combo)
+        params_layout.addLayout(output_format_layout)
         control_layout.addLayout(params_layout)
 
         # 预览控制按钮
@@ -559,90 +647,191 @@ class MainWindow(QMainWindow):
         self.preview = PreviewWidget()
         main_layout.addWidget(self.preview)
 
-        # 连接信号
-        self.font_combo.currentIndexChanged.connect(self.update_preview)
-        self.bg_combo.currentIndexChanged.connect(self.update_preview)
-        self.font_size_spin.valueChanged.connect(self.update_preview)
+        # 连接信号，连续变化时合并为一次预览
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(150)
+        self.preview_timer.timeout.connect(self.update_preview)
+        self.font_combo.currentIndexChanged.connect(self.preview_timer.start)
+        # 切换背景或用户时换用对应的参数配置
+        self.bg_combo.currentIndexChanged.connect(self.apply_profile)
+        self.user_combo.currentIndexChanged.connect(self.apply_profile)
+        self.bg_combo.currentIndexChanged.connect(self.preview_timer.start)
+        self.font_size_spin.valueChanged.connect(self.preview_timer.start)
         
         # 设置布局比例
         main_layout.setStretch(0, 1)  # 控制面板
         main_layout.setStretch(1, 2)  # 预览区域
-    def create_required_directories(self):
-        """创建必要的目录"""
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # 创建字体目录
-        fonts_dir = os.path.join(current_dir, "fonts")
-        os.makedirs(fonts_dir, exist_ok=True)
-        
-        # 创建背景图片目录
-        bg_dir = os.path.join(current_dir, "Background")
-        os.makedirs(bg_dir, exist_ok=True)
-        
-        # 创建参数配置目录
-        param_dir = os.path.join(current_dir, "Parameter")
-        os.makedirs(param_dir, exist_ok=True)
+    def showEvent(self, event):
+        """第一次显示后开始在后台扫描资源"""
+        super().showEvent(event)
+        if '窗口显示' not in self.startup_times:
+            self.mark_startup('窗口显示')
+            self.asset_scanner.start()
+
+    def assets_scanned(self, assets):
+        """资源扫描完成：填充列表、应用第一个背景的参数配置，然后开始第一次预览"""
+        # 填充列表时不触发按背景切换参数配置
+        for combo in (self.font_combo, self.bg_combo, self.user_combo):
+            combo.blockSignals(True)
+        self.load_fonts(assets['fonts'])
+        self.load_backgrounds(assets['backgrounds'])
+        for user in assets['users']:
+            self.user_combo.addItem(user, user)
+        for combo in (self.font_combo, self.bg_combo, self.user_combo):
+            combo.blockSignals(False)
+        if assets['params'] is not None:
+            self.update_params_from_config(assets['params'])
+        self.mark_startup('资源扫描')
+        if assets['error']:
+            QMessageBox.warning(self, "警告", assets['error'])
+        self.update_preview()
+
+    def mark_startup(self, stage):
+        """记录启动阶段的耗时；第一次预览完成后按需输出报告"""
+        self.startup_times[stage] = time.perf_counter() - STARTUP_TIME
+        if stage == '首次预览' and ('--startup-report' in sys.argv or os.environ.get('HANDWRITING_STARTUP_REPORT')):
+            print(self.startup_report(), file=sys.stderr)
+
+    def startup_report(self):
+        """启动耗时报告：各阶段距模块开始导入的时间"""
+        return '\n'.join(f"{stage}: {seconds * 1000:.0f} ms" for stage, seconds in self.startup_times.items())
 
-    def load_default_params(self):
-        """加载默认参数"""
+    def apply_profile(self):
+        """按当前背景和用户叠加参数配置；都没有配置时保留当前参数"""
+        background_path = self.bg_combo.currentData()
+        user = self.user_combo.currentData()
+        if not user and not (background_path and background_profile(background_path)):
+            return
         try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            default_param_path = os.path.join(current_dir, "Parameter", "default.json")
-            
-            if os.path.exists(default_param_path):
-                with open(default_param_path, 'r', encoding='utf-8') as f:
-                    params = json.load(f)
-                self.update_params_from_config(params)
-            else:
-                # 创建默认参数文件
-                default_params = {
-                    'font_size': 40,
-                    'line_spacing': 143,
-                    'word_spacing': 5,
-                    'left_margin': 180,
-                    'right_margin': 100,
-                    'top_margin': 140,
-                    'bottom_margin': 70,
-                    'word_spacing_sigma': 2,
-                    'line_spacing_sigma': 0,
-                    'perturb_x_sigma': 3,
-                    'perturb_y_sigma': 3,
-                    'perturb_theta_sigma': 0.05
-                }
-                
-                with open(default_param_path, 'w', encoding='utf-8') as f:
-                    json.dump(default_params, f, indent=4, ensure_ascii=False)
-        
-        except Exception as e:
-            QMessageBox.warning(self, "警告", f"加载默认参数失败: {str(e)}")
+            self.update_params_from_config(load_profile(background_path, user))
+        except ProfileError as e:
+            QMessageBox.warning(self, "警告", f"参数配置有误: {str(e)}")
+            return
+        self.preview_timer.start()
 
     def save_current_params(self):
-        """保存当前参数为默认值"""
+        """保存用户在界面中修改过的参数
+
+        只保存载入配置后改动过的项（不含随机种子、输出格式等运行参数），写入当前最上层的配置：
+        选了用户时为用户配置，否则为背景的参数配置，都没有时为 default.json
+        """
+        edits = {name: value for name, value in self.get_current_params().items()
+                 if name not in ('seed', 'output_format') and value != self.profile_params.get(name)}
+        if not edits:
+            return
         try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            default_param_path = os.path.join(current_dir, "Parameter", "default.json")
-            
-            params = self.get_current_params()
-            with open(default_param_path, 'w', encoding='utf-8') as f:
+            user = self.user_combo.currentData()
+            background_path = self.bg_combo.currentData()
+            if user:
+                path = user_profile(user)
+            else:
+                path = (background_path and background_profile(background_path)) or DEFAULT_PROFILE
+            params = {}
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    params = json.load(f)
+            params.update(edits)
+            with open(path, 'w', encoding='utf-8') as f:
                 json.dump(params, f, indent=4, ensure_ascii=False)
-            
-            QMessageBox.information(self, "成功", "参数已保存为默认值")
-        
+
+            QMessageBox.information(self, "成功", f"参数已保存到 {os.path.basename(path)}")
+
         except Exception as e:
             QMessageBox.warning(self, "错误", f"保存参数失败: {str(e)}")
 
     def select_input_file(self):
-        """选择输入文件"""
-        file_name, _ = QFileDialog.getOpenFileName(
+        """选择输入文件，可多选"""
+        file_names, _ = QFileDialog.getOpenFileNames(
             self,
             "选择文件",
             "",
             "文本文件 (*.txt);;Word文档 (*.docx *.doc)"
         )
-        if file_name:
-            self.input_path.setText(file_name)
+        if file_names:
+            self.add_input_files(file_names)
+
+    def select_input_dir(self):
+        """把文件夹中的所有文件加入队列"""
+        dir_path = QFileDialog.getExistingDirectory(self, "选择文件夹")
+        if dir_path:
+            self.add_input_files([dir_path])
+
+    def add_input_files(self, paths):
+        """把文件（或文件夹中的文件）加入队列表格，并预览第一个"""
+        files = [path for path in collect_inputs(paths, recursive=True)
+                 if path.lower().endswith(SUPPORTED_EXTS)]
+        if not files:
+            QMessageBox.warning(self, "错误", "不支持的文件格式！")
+            return
+        queued = {self.job_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
+                  for row in range(self.job_table.rowCount()) if self.job_id(row) is None}
+        first_row = self.job_table.rowCount()
+        for file_path in files:
+            if file_path in queued:
+                continue
+            row = self.job_table.rowCount()
+            self.job_table.insertRow(row)
+            item = QTableWidgetItem(os.path.basename(file_path))
+            item.setToolTip(file_path)
+            item.setData(Qt.ItemDataRole.UserRole, file_path)
+            self.job_table.setItem(row, 0, item)
+            self.job_table.setItem(row, 1, QTableWidgetItem('未开始'))
+            self.job_table.setItem(row, 2, QTableWidgetItem(''))
+        if first_row < self.job_table.rowCount():
+            self.job_table.setCurrentCell(first_row, 0)
+        else:
+            self.input_path.setText(files[0])
             self.update_preview()
 
+    def job_id(self, row):
+        """该行对应的任务编号，尚未提交时为 None"""
+        return self.job_table.item(row, 0).data(Qt.ItemDataRole.UserRole + 1)
+
+    def job_row_selected(self, row, column, previous_row, previous_column):
+        """选中队列中的文件时预览该文件"""
+        if row < 0 or row == previous_row:
+            return
+        file_path = self.job_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
+        if file_path != self.input_path.text():
+            self.input_path.setText(file_path)
+            self.update_preview()
+
+    def selected_job_rows(self):
+        return sorted({index.row() for index in self.job_table.selectionModel().selectedRows()})
+
+    def move_job_rows(self, offset):
+        """上移/下移选中的行，并按表格顺序调整等待中任务的优先级"""
+        rows = self.selected_job_rows()
+        if not rows or rows[0] + offset < 0 or rows[-1] + offset >= self.job_table.rowCount():
+            return
+        for row in (rows if offset < 0 else reversed(rows)):
+            items = [self.job_table.takeItem(row, column) for column in range(3)]
+            other = [self.job_table.takeItem(row + offset, column) for column in range(3)]
+            for column in range(3):
+                self.job_table.setItem(row + offset, column, items[column])
+                self.job_table.setItem(row, column, other[column])
+        self.job_table.clearSelection()
+        for row in rows:
+            self.job_table.selectRow(row + offset)
+        self.job_queue.reorder([self.job_id(row) for row in range(self.job_table.rowCount())])
+
+    def cancel_job_rows(self):
+        """取消选中的任务；尚未提交的直接移出队列"""
+        for row in reversed(self.selected_job_rows()):
+            job_id = self.job_id(row)
+            if job_id is None:
+                self.job_table.removeRow(row)
+            else:
+                self.job_queue.cancel(job_id)
+
+    def clear_finished_jobs(self):
+        """移除已结束的任务"""
+        for row in reversed(range(self.job_table.rowCount())):
+            job_id = self.job_id(row)
+            if job_id is not None and self.job_queue.jobs[job_id].finished:
+                self.job_table.removeRow(row)
+
     def select_output_dir(self):
         """选择输出目录"""
         dir_name = QFileDialog.getExistingDirectory(
@@ -652,52 +841,83 @@ class MainWindow(QMainWindow):
         )
         if dir_name:
             self.output_path.setText(dir_name)
+            # 预览的随机种子取自输出目录中上次的转换
+            self.preview_timer.start()
 
     def update_preview(self):
-        """更新预览图"""
+        """更新预览图（在后台线程渲染）"""
+        self.preview_timer.stop()
         if not self.bg_combo.currentData() or not self.font_combo.currentData():
             return
-                
-        try:
-            # 获取当前文件内容
-            preview_text = ""
-            if self.input_path.text() and os.path.exists(self.input_path.text()):
-                file_path = self.input_path.text()
-                if file_path.lower().endswith('.txt'):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                elif file_path.lower().endswith(('.docx', '.doc')):
-                    content = docx2txt.process(file_path)
-                else:
-                    content = "不支持的文件格式"
-                
-             # 分页处理
-                self.preview_pages = self.split_content_to_pages(content)
-                self.current_preview_page = 0
-                
-                # 更新翻页按钮状态
-                self.update_page_controls()
-                
-                # 显示当前页
-                self.show_current_preview_page()
-            else:
-                # 无文件时显示默认预览
-                preview_text = "预览文本\n第二行文本"
-                params = self.get_current_params()
-                params['preview_text'] = preview_text
-                self.preview.update_preview(
-                    background_path=self.bg_combo.currentData(),
-                    font_path=self.font_combo.currentData(),
-                    params=params
-                )
-                
-        except Exception as e:
-            QMessageBox.warning(self, "预览失败", str(e))
+        
+        # 获取当前文件，无文件时显示默认预览
+        file_path = self.input_path.text()
+        if not file_path or not os.path.exists(file_path):
+            file_path = None
+        
+        # 参数或文件变化后，旧请求的结果全部作废
+        self.preview_generation += 1
+        self.preview_images.clear()
+        self.missing_chars = ''
+        self.preview_request = (file_path, self.get_render_params())
+        self.current_preview_page = 0
+        self.request_preview_page()
+
+    def request_preview_page(self):
+        """请求当前页，已缓存时立即显示"""
+        image = self.preview_images.get(self.current_preview_page)
+        if image is not None:
+            self.preview_images.move_to_end(self.current_preview_page)
+            self.preview.show_image(image)
+        file_path, params = self.preview_request
+        self.preview_worker.request(self.preview_generation, file_path, params,
+                                    self.current_preview_page, self.preview_images.keys(), self.output_path.text())
+
+    def preview_rendered(self, generation, page_index, page_count, image):
+        """后台渲染完成"""
+        if generation != self.preview_generation:
+            return
+        self.preview_images[page_index] = image
+        self.preview_images.move_to_end(page_index)
+        while len(self.preview_images) > 5:
+            self.preview_images.popitem(last=False)
+        
+        self.preview_page_count = page_count
+        if page_index == self.current_preview_page:
+            self.preview.show_image(image)
+            if '首次预览' not in self.startup_times:
+                self.mark_startup('首次预览')
+        self.update_page_controls()
+
+    def preview_missing(self, generation, chars):
+        """记录字体缺少的字符，转换前提示"""
+        if generation == self.preview_generation:
+            self.missing_chars = chars
+
+    def preview_failed(self, generation, message):
+        """后台渲染失败"""
+        if generation == self.preview_generation:
+            self.preview.setText(f"预览失败: {message}")
+
+    def get_render_params(self):
+        """当前参数加上字体和背景路径，预览和转换共用
 
+        取消或中断过的文件从断点继续（参数或文件有变化时自动从头转换）；预览也按断点取随机种子，
+        重启程序后预览排好的版仍能用于继续转换
+        """
+        return {
+            'font_path': self.font_combo.currentData(),
+            'background_path': self.bg_combo.currentData(),
+            **self.get_current_params(),
+            'resume': True,
+        }
 
     def start_conversion(self):
-        """开始转换"""
-        if not self.input_path.text():
+        """提交队列中尚未开始的文件"""
+        if not self.job_table.rowCount() and self.input_path.text():
+            self.add_input_files([self.input_path.text()])
+        rows = [row for row in range(self.job_table.rowCount()) if self.job_id(row) is None]
+        if not rows:
             QMessageBox.warning(self, "警告", "请选择输入文件！")
             return
         if not self.output_path.text():
@@ -709,54 +929,76 @@ class MainWindow(QMainWindow):
         if not self.bg_combo.currentData():
             QMessageBox.warning(self, "警告", "请选择背景图片！")
             return
+        if self.missing_chars:
+            answer = QMessageBox.question(
+                self, "缺少字形",
+                f"所选字体缺少 {len(self.missing_chars)} 个字符，它们将显示为方框：\n"
+                f"{self.missing_chars[:100]}\n\n是否继续转换？")
+            if answer != QMessageBox.StandardButton.Yes:
+                return
 
-        # 禁用转换按钮
-        self.convert_btn.setEnabled(False)
-        self.progress.setValue(0)
+        # 每个任务使用提交时的参数，之后修改参数不影响已提交的任务
+        params = self.get_render_params()
+        variants = None
+        if self.all_backgrounds_check.isChecked():
+            backgrounds = [self.bg_combo.itemData(index) for index in range(self.bg_combo.count())]
+            try:
+                variants = variant_params(params, backgrounds, self.user_combo.currentData())
+            except ProfileError as e:
+                QMessageBox.warning(self, "警告", f"参数配置有误: {str(e)}")
+                return
+        if self.job_queue.is_idle():
+            self.batch_job_ids = []
+        for row in rows:
+            item = self.job_table.item(row, 0)
+            job = self.job_queue.add(item.data(Qt.ItemDataRole.UserRole), self.output_path.text(), params,
+                                     variants)
+            item.setData(Qt.ItemDataRole.UserRole + 1, job.id)
+            self.batch_job_ids.append(job.id)
+        self.batch_active = True
+        self.job_queue.reorder([self.job_id(row) for row in range(self.job_table.rowCount())])
 
-        # 准备参数
-        params = {
-            'font_path': self.font_combo.currentData(),
-            'background_path': self.bg_combo.currentData(),
-            **self.get_current_params()
-        }
-
-        # 创建并启动转换线程
-        self.converter = HandwritingConverter(
-            self.input_path.text(),
-            self.output_path.text(),
-            params
-        )
-        self.converter.progress.connect(self.update_conversion_progress)
-        self.converter.finished.connect(self.conversion_finished)
-        self.converter.start()
+    def update_job(self, job_id):
+        """任务状态变化：更新所在行和总进度"""
+        job = self.job_queue.jobs[job_id]
+        for row in range(self.job_table.rowCount()):
+            if self.job_id(row) == job_id:
+                status = self.job_table.item(row, 1)
+                status.setText(JOB_STATUS_TEXT[job.status])
+                status.setToolTip(job.message)
+                progress = 100 if job.status == DONE else job.progress
+                self.job_table.item(row, 2).setText(f'{progress}%' if progress else '')
+                break
 
-    def update_conversion_progress(self, value, message):
-        """更新转换进度"""
+        jobs = [self.job_queue.jobs[job_id] for job_id in self.batch_job_ids]
+        finished = sum(1 for job in jobs if job.finished)
+        value = self.job_queue.progress()
         self.progress.setValue(value)
-        self.progress.setFormat(f"{message} ({value}%)")
+        self.progress.setFormat(f"已完成 {finished}/{len(jobs)} 个文件 ({value}%)")
+        if self.batch_active and finished == len(jobs) and self.job_queue.is_idle():
+            self.batch_active = False
+            self.conversion_finished(jobs)
 
-    def conversion_finished(self, success, message):
-        """转换完成处理"""
-        self.convert_btn.setEnabled(True)
-        
-        if success:
+    def conversion_finished(self, jobs):
+        """一批任务全部结束"""
+        done = [job for job in jobs if job.status == DONE]
+        failed = [job for job in jobs if job.status == FAILED]
+        message = f"转换完成！成功 {len(done)} 个文件"
+        if failed:
+            message += f"，失败 {len(failed)} 个：\n" + '\n'.join(
+                f"{os.path.basename(job.input_file)}: {job.message}" for job in failed)
+            QMessageBox.warning(self, "完成", message)
+        else:
             QMessageBox.information(self, "完成", message)
+        if done:
             # 打开输出目录
             os.startfile(self.output_path.text())
-        else:
-            QMessageBox.warning(self, "错误", message)
-    def load_fonts(self):
-        """加载字体列表"""
+
+    def load_fonts(self, fonts):
+        """加载字体列表，fonts 为扫描得到的 [(文件名, 路径), ...]"""
         self.font_combo.clear()
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        fonts_dir = os.path.join(current_dir, "fonts")
-        
-        if os.path.exists(fonts_dir):
-            for font_file in os.listdir(fonts_dir):
-                if font_file.lower().endswith('.ttf'):
-                    font_path = os.path.join(fonts_dir, font_file)
-                    self.font_combo.addItem(font_file, font_path)
+        for font_file, font_path in fonts:
+            self.font_combo.addItem(font_file, font_path)
     def get_current_params(self):
         """获取当前参数设置"""
         return {
@@ -769,9 +1011,12 @@ class MainWindow(QMainWindow):
             'bottom_margin': self.bottom_margin_spin.value(),
             'perturb_x_sigma': self.perturb_x_spin.value(),
             'perturb_y_sigma': self.perturb_y_spin.value(),
+            'font_size_sigma': self.font_size_sigma_spin.value(),
             'perturb_theta_sigma': 0.05,  # 角度扰动固定值
             'word_spacing_sigma': 2,  # 字间距扰动固定值
             'line_spacing_sigma': 0,  # 行间距扰动固定值
+            'output_format': self.format_combo.currentData(),
+            'seed': self.seed,
         }
 
     def update_params_from_config(self, params):
@@ -786,92 +1031,45 @@ class MainWindow(QMainWindow):
             self.bottom_margin_spin.setValue(params.get('bottom_margin', 70))
             self.perturb_x_spin.setValue(params.get('perturb_x_sigma', 3))
             self.perturb_y_spin.setValue(params.get('perturb_y_sigma', 3))
+            self.font_size_sigma_spin.setValue(params.get('font_size_sigma', 0))
+            self.format_combo.setCurrentIndex(max(0, self.format_combo.findData(params.get('output_format', 'png'))))
+            self.seed = params.get('seed')
+            self.profile_params = self.get_current_params()
         except Exception as e:
             QMessageBox.warning(self, "警告", f"加载参数失败: {str(e)}")
-    def load_backgrounds(self):
-        """加载背景图片列表"""
+    def load_backgrounds(self, backgrounds):
+        """加载背景图片列表，backgrounds 为扫描得到的 [(文件名, 路径), ...]"""
         self.bg_combo.clear()
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        bg_dir = os.path.join(current_dir, "Background")
-        
-        if os.path.exists(bg_dir):
-            for bg_file in os.listdir(bg_dir):
-                if bg_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    bg_path = os.path.join(bg_dir, bg_file)
-                    self.bg_combo.addItem(bg_file, bg_path)
+        for bg_file, bg_path in backgrounds:
+            self.bg_combo.addItem(bg_file, bg_path)
     def closeEvent(self, event):
         """关闭窗口时保存参数"""
         self.save_current_params()
-        if self.converter and self.converter.isRunning():
-            self.converter.stop()
-            self.converter.wait()
+        self.job_queue.close()
+        self.preview_worker.stop()
+        self.preview_worker.wait()
         event.accept()
 
-    def split_content_to_pages(self, content):
-        """将内容分割成页"""
-        # 获取当前参数
-        params = self.get_current_params()
-        
-        # 计算每页能容纳的行数
-        background = Image.open(self.bg_combo.currentData())
-        available_height = background.height - params['top_margin'] - params['bottom_margin']
-        line_height = params['font_size'] + params['line_spacing']
-        lines_per_page = int(available_height / line_height)
-        
-        # 分割内容
-        lines = content.split('\n')
-        pages = []
-        current_page = []
-        line_count = 0
-        
-        for line in lines:
-            if line_count >= lines_per_page:
-                pages.append('\n'.join(current_page))
-                current_page = []
-                line_count = 0
-            current_page.append(line)
-            line_count += 1
-        
-        if current_page:
-            pages.append('\n'.join(current_page))
-        
-        return pages
-
-    def show_current_preview_page(self):
-        """显示当前预览页"""
-        if not self.preview_pages:
-            return
-            
-        params = self.get_current_params()
-        params['preview_text'] = self.preview_pages[self.current_preview_page]
-        
-        self.preview.update_preview(
-            background_path=self.bg_combo.currentData(),
-            font_path=self.font_combo.currentData(),
-            params=params
-        )
-        
-        # 更新页码显示
-        self.page_label.setText(f'第 {self.current_preview_page + 1} 页 / 共 {len(self.preview_pages)} 页')
-
     def update_page_controls(self):
-        """更新翻页按钮状态"""
-        has_pages = len(self.preview_pages) > 0
+        """更新翻页按钮和页码显示"""
+        has_pages = self.preview_page_count > 0
         self.prev_page_btn.setEnabled(has_pages and self.current_preview_page > 0)
-        self.next_page_btn.setEnabled(has_pages and self.current_preview_page < len(self.preview_pages) - 1)
+        self.next_page_btn.setEnabled(has_pages and self.current_preview_page < self.preview_page_count - 1)
+        if has_pages:
+            self.page_label.setText(f'第 {self.current_preview_page + 1} 页 / 共 {self.preview_page_count} 页')
 
     def prev_preview_page(self):
         """显示上一页"""
         if self.current_preview_page > 0:
             self.current_preview_page -= 1
-            self.show_current_preview_page()
+            self.request_preview_page()
             self.update_page_controls()
 
     def next_preview_page(self):
         """显示下一页"""
-        if self.current_preview_page < len(self.preview_pages) - 1:
+        if self.current_preview_page < self.preview_page_count - 1:
             self.current_preview_page += 1
-            self.show_current_preview_page()
+            self.request_preview_page()
             self.update_page_controls()
 def main():
     import sys